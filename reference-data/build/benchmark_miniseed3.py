@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+#
+# Benchmark reading and writing miniSEED V3 records.
+#
+# Header pack and unpack, CRC-32C, payload decoding, extra header
+# parsing and a full scan are timed over each reference file and,
+# optionally, over the files of a larger archive such as one made by
+# generate_archive.py.  Each benchmark is repeated and the best time is
+# reported as operations and megabytes per second, with the peak memory
+# allocated while it runs measured in a separate traced run.
+#
+# Results can be saved as JSON and compared with a saved baseline, in
+# which case benchmarks that have become slower than the threshold are
+# reported and the exit status is 1.
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import resource
+import tracemalloc
+import collections
+import concurrent.futures
+
+import numpy as np
+
+import ms3crc
+from ms3crc import record_crc
+from ms3payload import DECODED_TYPES, decode_payload
+from ms3reader import MS3File, RecordView, find_files, iter_frames
+from ms3record import FIXED_HEADER, FIXED_HEADER_LENGTH
+from ms3trace import assemble_files
+
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+REFERENCE_PATTERN = 'reference-*.mseed3'
+
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_REPEATS = 5
+DEFAULT_THRESHOLD = 0.1
+
+RESULTS_FORMAT = 'MS3BENCH1'
+
+# A benchmark runs function once for operations of a total of bytes
+Benchmark = collections.namedtuple('Benchmark', [
+    'name',
+    'function',
+    'operations',
+    'bytes',
+    'traced',  # False if the peak memory cannot be measured in process
+])
+Benchmark.__new__.__defaults__ = (True,)
+
+# Best time of a run in seconds and peak traced memory in bytes
+Result = collections.namedtuple('Result', [
+    'name',
+    'seconds',
+    'operations',
+    'bytes',
+    'peak',
+])
+
+
+# Return the best time of a number of runs of function, each of
+# enough calls to take at least min_time, as seconds per call
+def best_time(function, min_time, repeats):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+
+    return best / number
+
+
+# Return the peak memory allocated during a call of function
+def peak_memory(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(benchmark, min_time, repeats):
+    seconds = best_time(benchmark.function, min_time, repeats)
+    peak = peak_memory(benchmark.function) if benchmark.traced else None
+    return Result(benchmark.name, seconds, benchmark.operations, benchmark.bytes, peak)
+
+
+# Return the record views of a buffer
+def buffer_records(buffer):
+    return [RecordView(buffer, offset) for offset, _ in iter_frames(buffer)]
+
+
+# Return a function unpacking the fixed header of every record
+def header_unpack(buffer, offsets):
+    def unpack():
+        for offset in offsets:
+            FIXED_HEADER.unpack_from(buffer, offset)
+    return unpack
+
+
+# Return a function packing the fixed headers of records
+def header_pack(headers):
+    output = bytearray(FIXED_HEADER_LENGTH)
+
+    def pack():
+        for header in headers:
+            FIXED_HEADER.pack_into(output, 0, *header)
+    return pack
+
+
+# Return a function calculating the CRC of every record
+def record_crcs(records):
+    def crcs():
+        for record in records:
+            record_crc(record)
+    return crcs
+
+
+# Return a function decoding the payloads of records
+def payload_decode(records):
+    arguments = [(record.payload, record.encoding, record.number_samples)
+                 for record in records if record.encoding in DECODED_TYPES]
+
+    def decode():
+        for payload, encoding, number_samples in arguments:
+            decode_payload(payload, encoding, number_samples)
+    return decode
+
+
+# Return a function parsing the extra headers of records, with new
+# views each time as views keep what they decoded
+def extra_header_parse(buffer, offsets):
+    def parse():
+        for offset in offsets:
+            RecordView(buffer, offset).extra_headers
+    return parse
+
+
+# Scan a file: frame every record, verify its CRC, decode its payload
+# and parse its extra headers.  Return (records, bytes, samples, CRC
+# errors).
+def scan_file(path):
+    records = samples = errors = 0
+    with MS3File(path) as ms3file:
+        for record in ms3file:
+            records += 1
+            if not record.crc_valid:
+                errors += 1
+            if record.encoding in DECODED_TYPES:
+                samples += len(decode_payload(record.payload, record.encoding,
+                                              record.number_samples))
+            if record.length_extra_header:
+                record.extra_headers
+            del record
+        return records, len(ms3file), samples, errors
+
+
+# Scan files in parallel, return the totals of scan_file()
+def scan_files(paths, workers=None):
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return [sum(values) for values in zip(*executor.map(scan_file, paths, chunksize=chunksize))]
+
+
+# Return the benchmarks of a reference file, named by its label
+def reference_benchmarks(path):
+    label = os.path.basename(path)[len('reference-'):-len('.mseed3')]
+    with open(path, 'rb') as fp:
+        buffer = memoryview(fp.read())
+
+    records = buffer_records(buffer)
+    offsets = [record.offset for record in records]
+    length = len(buffer)
+    headers = [FIXED_HEADER.unpack_from(buffer, offset) for offset in offsets]
+    header_bytes = FIXED_HEADER_LENGTH * len(records)
+
+    benchmarks = [
+        Benchmark(f'header unpack/{label}', header_unpack(buffer, offsets), len(records), header_bytes),
+        Benchmark(f'header pack/{label}', header_pack(headers), len(records), header_bytes),
+        Benchmark(f'crc/{label}', record_crcs([record.record for record in records]),
+                  len(records), length),
+    ]
+
+    decoded = [record for record in records if record.encoding in DECODED_TYPES]
+    if decoded:
+        benchmarks.append(Benchmark(f'decode/{label}', payload_decode(decoded), len(decoded),
+                                    sum(record.length_payload for record in decoded)))
+
+    extra = [record for record in records if record.length_extra_header]
+    if extra:
+        benchmarks.append(Benchmark(f'extra headers/{label}',
+                                    extra_header_parse(buffer, [record.offset for record in extra]),
+                                    len(extra), sum(record.length_extra_header for record in extra)))
+
+    benchmarks.append(Benchmark(f'scan/{label}', lambda: scan_file(path), len(records), length))
+    return benchmarks
+
+
+# Return the benchmarks of the files of an archive and the open files.
+# Each runs over all files, which are mapped once and must be closed
+# when the benchmarks are done.  The parallel scan runs in worker
+# processes, so its peak memory is not measured.
+def archive_benchmarks(paths, workers):
+    files = [MS3File(path) for path in paths]
+    buffers = [ms3file.buffer for ms3file in files]
+    records = [buffer_records(buffer) for buffer in buffers]
+    offsets = [[record.offset for record in file_records] for file_records in records]
+
+    number = sum(len(file_records) for file_records in records)
+    length = sum(len(buffer) for buffer in buffers)
+    decoded = [[record for record in file_records if record.encoding in DECODED_TYPES]
+               for file_records in records]
+    extra = [[record.offset for record in file_records if record.length_extra_header]
+             for file_records in records]
+
+    def run_all(functions):
+        return lambda: [function() for function in functions]
+
+    benchmarks = [
+        Benchmark('archive/header unpack',
+                  run_all([header_unpack(buffer, file_offsets)
+                           for buffer, file_offsets in zip(buffers, offsets)]),
+                  number, FIXED_HEADER_LENGTH * number),
+        Benchmark('archive/crc',
+                  run_all([record_crcs([record.record for record in file_records])
+                           for file_records in records]),
+                  number, length),
+        Benchmark('archive/decode',
+                  run_all([payload_decode(file_decoded) for file_decoded in decoded]),
+                  sum(map(len, decoded)),
+                  sum(record.length_payload for file_decoded in decoded for record in file_decoded)),
+        Benchmark('archive/extra headers',
+                  run_all([extra_header_parse(buffer, file_extra)
+                           for buffer, file_extra in zip(buffers, extra)]),
+                  sum(map(len, extra)),
+                  sum(record.length_extra_header for file_records in records
+                      for record in file_records if record.length_extra_header)),
+        Benchmark('archive/scan', lambda: [scan_file(path) for path in paths], number, length),
+        Benchmark('archive/trace assembly', lambda: assemble_files(paths), number, length),
+    ]
+    if workers != 1:
+        benchmarks.append(Benchmark('archive/parallel scan', lambda: scan_files(paths, workers),
+                                    number, length, False))
+
+    del records, decoded
+    return benchmarks, files
+
+
+def format_result(result):
+    seconds = max(result.seconds, 1e-12)
+    peak = '-' if result.peak is None else f'{result.peak / 1024:.0f}'
+    return (f'{result.name:<40} {result.operations / seconds:>14,.0f} {result.bytes / seconds / 1e6:>10.1f} '
+            f'{peak:>10}')
+
+
+# Return results saved with save_results()
+def load_results(path):
+    with open(path, encoding='utf-8') as fp:
+        data = json.load(fp)
+    if data.get('format') != RESULTS_FORMAT:
+        raise ValueError(f'{path} is not a benchmark results file')
+    return {result['name']: Result(**result) for result in data['results']}
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump({'format': RESULTS_FORMAT,
+                   'environment': environment(),
+                   'results': [result._asdict() for result in results]},
+                  fp, indent=1)
+
+
+# Return a description of the environment results were measured in
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'crc': ms3crc.BACKEND,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+# Return the names of results slower than those of the baseline by more
+# than threshold, a fraction of the baseline throughput
+def regressions(results, baseline, threshold):
+    slower = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None or base.operations == 0 or result.operations == 0:
+            continue
+        ratio = (base.seconds / base.operations) / (result.seconds / result.operations)
+        if ratio < 1.0 - threshold:
+            slower.append((result.name, ratio))
+    return slower
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark miniSEED V3 record operations.')
+
+    parser.add_argument('-a', '--archive', dest='archive', nargs='+', default=None,
+                        help='Also benchmark these archive files or directories')
+    parser.add_argument('-p', '--pattern', dest='pattern', default='*.mseed3',
+                        help='File name pattern in archive directories (default "*.mseed3")')
+    parser.add_argument('-R', '--no-reference', dest='reference', action='store_false',
+                        help='Skip the reference file benchmarks')
+    parser.add_argument('-k', '--select', dest='select', default=None,
+                        help='Only run benchmarks with names containing this text')
+    parser.add_argument('-t', '--min-time', dest='min_time', default=DEFAULT_MIN_TIME, type=float,
+                        help=f'Minimum time of each timed run in seconds (default {DEFAULT_MIN_TIME})')
+    parser.add_argument('-r', '--repeats', dest='repeats', default=DEFAULT_REPEATS, type=int,
+                        help=f'Timed runs of each benchmark, the best is reported (default {DEFAULT_REPEATS})')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Worker processes of the parallel archive scan (default is number of CPUs)')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='Save the results as JSON to this file')
+    parser.add_argument('-b', '--baseline', dest='baseline', default=None,
+                        help='Compare with results saved to this file')
+    parser.add_argument('--threshold', dest='threshold', default=DEFAULT_THRESHOLD, type=float,
+                        help=f'Slowdown reported as a regression (default {DEFAULT_THRESHOLD})')
+
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline) if args.baseline else None
+
+    benchmarks = []
+    if args.reference:
+        for path in sorted(find_files([REFERENCE_DIR], REFERENCE_PATTERN)):
+            benchmarks.extend(reference_benchmarks(path))
+
+    files = []
+    if args.archive:
+        paths = sorted(find_files(args.archive, args.pattern))
+        archive, files = archive_benchmarks(paths, args.jobs)
+        benchmarks.extend(archive)
+        del archive
+
+    if args.select:
+        benchmarks = [benchmark for benchmark in benchmarks if args.select in benchmark.name]
+
+    print(', '.join(f'{name} {value}' for name, value in environment().items()))
+    print(f'{"benchmark":<40} {"ops/s":>14} {"MB/s":>10} {"peak KiB":>10}')
+
+    results = []
+    try:
+        for benchmark in benchmarks:
+            result = run_benchmark(benchmark, args.min_time, args.repeats)
+            results.append(result)
+            print(format_result(result), flush=True)
+    finally:
+        del benchmarks
+        for ms3file in files:
+            ms3file.close()
+
+    # Peak resident memory, in KiB on Linux
+    print(f'Peak resident memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} KiB')
+
+    if args.output:
+        save_results(args.output, results)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        for name, ratio in slower:
+            print(f'Regression: {name} at {ratio:.2f} of baseline throughput', file=sys.stderr)
+        if slower:
+            exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
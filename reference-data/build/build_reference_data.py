@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Build reference data in a single process using the record generator
+# and the JSON and text converters.
+#
+# The records are built in the output directory (default is the
+# current directory), when ready they can be copied to the parent
+# directory where the reference data are located.
+
+import os
+import shlex
+import argparse
+
+from generate_miniseed3 import parse_args, build_record
+from ms3convert import write_json, write_text
+from ms3reader import iter_records
+from ms3record import pack_records
+
+EXTRA_HEADERS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'extra-headers')
+
+# Reference file name and generate_miniseed3.py arguments
+REFERENCE_DATA = (
+    # Event detection, extra headers only
+    ('reference-detectiononly', '-s 0 -Y 2004 -D 210 -H 20 -M 28 -S 9 -N 0 -e {extra}/Example-ExtraHeaders-FDSN-Detection.json -V 2 -i FDSN:XX_TEST__L_H_Z'),
+    # Text data
+    ('reference-text', '-p text -i FDSN:XX_TEST__L_O_G'),
+    # 16-bit integer data
+    ('reference-sinusoid-int16', '-p int16 -i FDSN:XX_TEST__L_H_Z -s 1 -f 00000100'),
+    # 32-bit integer data
+    ('reference-sinusoid-int32', '-p int32 -i FDSN:XX_TEST__V_H_Z -s -10 -f 00000100'),
+    # 32-bit float data
+    ('reference-sinusoid-float32', '-p float32 -i FDSN:XX_TEST__B_H_Z -s 20'),
+    # 64-bit float data
+    ('reference-sinusoid-float64', '-p float64 -i FDSN:XX_TEST__H_H_Z -s 100'),
+    # Steim-1 compressed data
+    ('reference-sinusoid-steim1', '-p steim1 -i FDSN:XX_TEST__L_H_Z -s 1 -f 00000100'),
+    # Steim-2 compressed data
+    ('reference-sinusoid-steim2', '-p steim2 -i FDSN:XX_TEST__M_H_Z -s 5 -f 00000100'),
+    # Steim-2 compressed data, with time quality, correction, and event detections
+    ('reference-sinusoid-TQ-TC-ED', '-p steim2 -i FDSN:XX_TEST__L_H_Z -s 1 -N 123000000 -f 00000100 -e {extra}/Example-ExtraHeaders-FDSN-TQ-ED.json'),
+    # Steim-2 compressed data, with FDSN and non-FDSN extra headers
+    ('reference-sinusoid-FDSN-Other', '-p steim2 -i FDSN:XX_TEST__L_H_Z -s 1 -N 123000000 -f 00000100 -e {extra}/Example-ExtraHeaders-FDSN-Other.json'),
+    # Steim-2 compressed data, with all FDSN extra headers
+    ('reference-sinusoid-FDSN-All', '-p steim2 -i FDSN:XX_TEST__L_H_Z -s 1 -N 123000000 -f 00000100 -e {extra}/Example-ExtraHeaders-FDSN-All.json'),
+)
+
+
+# Build the .mseed3, .json and .txt files of a reference record
+def build_reference(name, arguments, output_dir):
+    args = parse_args(shlex.split(arguments.format(extra=EXTRA_HEADERS)))
+    buffer = pack_records([build_record(args)])
+    path = os.path.join(output_dir, name)
+
+    with open(path + '.mseed3', 'wb') as fp:
+        fp.write(buffer)
+    with open(path + '.json', 'w', encoding='utf-8', newline='\n') as fp:
+        write_json(iter_records(buffer), fp)
+    with open(path + '.txt', 'w', encoding='utf-8', newline='\n') as fp:
+        write_text(iter_records(buffer), fp)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Build miniSEED V3 reference data.')
+
+    parser.add_argument('-o', '--output', dest='output', default='.',
+                        help='Output directory (default is current directory)')
+
+    args = parser.parse_args()
+
+    for name, arguments in REFERENCE_DATA:
+        print(f'Building {name}.mseed3')
+        build_reference(name, arguments, args.output)
+
+    print()
+    print('Copy new reference-* files to the parent directory to replace canonical reference files')
+
+
+if __name__ == '__main__':
+    main()
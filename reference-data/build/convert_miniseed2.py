@@ -0,0 +1,765 @@
+#!/usr/bin/env python3
+#
+# Convert miniSEED 2.4 records to miniSEED V3 following the mapping in
+# appendix-24mapping.rst.
+#
+# Input is read in chunks into a single reusable buffer and each record
+# is converted and packed into the output buffer of a RecordWriter as
+# soon as it is framed, so memory use is bounded by the buffer sizes
+# regardless of the size of the input.  Steim payloads are copied as-is
+# without decompression, trailing unused frames are dropped.  Payloads
+# in encodings retired in V3 are decoded and re-encoded.  Blockettes
+# without a mapping are dropped and counted.  Files can be converted in
+# parallel by a pool of worker processes.
+
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import functools
+import collections
+import concurrent.futures
+
+import numpy as np
+
+import steim
+from ms3record import (MS3Record, RecordWriter, ENCODING_TEXT, ENCODING_FLOAT32,
+                       ENCODING_STEIM1, ENCODING_STEIM2, SAMPLE_SIZES, STEIM_ENCODINGS,
+                       STEIM_FRAME_LENGTH, DEFAULT_BUFFER_SIZE, NS_PER_SECOND,
+                       fields_to_nstime, nstime_to_fields, nstime_to_isotime)
+
+
+# miniSEED 2.4 Fixed Section of Data Header (FSDH), 48 bytes, in the
+# byte order of the record
+#
+# #  FIELD                       TYPE       OFFSET
+# 1  sequence number             char[6]       0
+# 2  data quality indicator      char          6
+# 3  reserved                    char          7
+# 4  station code                char[5]       8
+# 5  location identifier         char[2]      13
+# 6  channel identifier          char[3]      15
+# 7  network code                char[2]      18
+# 8  record start time           BTIME        20
+# 9  number of samples           uint16       30
+# 10 sample rate factor          int16        32
+# 11 sample rate multiplier      int16        34
+# 12 activity flags              uint8        36
+# 13 I/O and clock flags         uint8        37
+# 14 data quality flags          uint8        38
+# 15 number of blockettes        uint8        39
+# 16 time correction             int32        40
+# 17 beginning of data           uint16       44
+# 18 first blockette             uint16       46
+#
+# BTIME is year, day, hour, minute, second, unused and fractional
+# seconds in units of 0.0001 seconds.
+
+FSDH = {order: struct.Struct(order + '6scx5s2s3s2sHHBBBxHHhhBBBBlHH')
+        for order in '<>'}
+FSDH_LENGTH = 48
+YEAR_DAY = {order: struct.Struct(order + 'HH') for order in '<>'}
+YEAR_OFFSET = 20
+
+# Blockette header: type and offset of the next blockette
+BLOCKETTE_HEADER = {order: struct.Struct(order + 'HH') for order in '<>'}
+
+# Blockette bodies, following the blockette header.  Times are BTIME
+# fields.
+BTIME = 'HHBBBxH'
+B100 = {order: struct.Struct(order + 'f') for order in '<>'}
+B200 = {order: struct.Struct(order + 'fffBx' + BTIME + '24s') for order in '<>'}
+B201 = {order: struct.Struct(order + 'fffBx' + BTIME + '6sBB24s') for order in '<>'}
+B300 = {order: struct.Struct(order + BTIME + 'BBLLf3sxL12s12s') for order in '<>'}
+B310 = {order: struct.Struct(order + BTIME + 'xBLff3sxL12s12s') for order in '<>'}
+B320 = {order: struct.Struct(order + BTIME + 'xBLf3sxL12s12s8s') for order in '<>'}
+B390 = {order: struct.Struct(order + BTIME + 'xBLf3sx') for order in '<>'}
+B500 = {order: struct.Struct(order + 'fHHBBBxHbBL16s32s128s') for order in '<>'}
+B1000 = struct.Struct('BBB')
+B1001 = struct.Struct('BbxB')
+
+# Total lengths of the blockettes that are converted, other blockettes
+# have no mapping to V3 and are dropped.  Blockette 395 is dropped too:
+# it holds only the end time of an aborted calibration, which alone
+# does not identify a calibration sequence.
+BLOCKETTE_LENGTHS = {100: 12, 200: 52, 201: 60, 300: 60, 310: 60, 320: 64,
+                     390: 28, 500: 200, 1000: 8, 1001: 8}
+
+# Event detection blockettes and their detection types
+DETECTIONS = {200: 'GENERIC', 201: 'MURDOCK'}
+DETECTION_DILATATION = 0x01
+DETECTION_DECONVOLVED = 0x02
+
+# Calibration blockettes and their calibration types
+CALIBRATIONS = {300: 'STEP', 310: 'SINE', 320: 'PSEUDORANDOM', 390: 'GENERIC'}
+CALIBRATION_BLOCKETTES = {300: B300, 310: B310, 320: B320, 390: B390}
+CALIBRATION_FIRST_PULSE_POSITIVE = 0x01
+CALIBRATION_ALTERNATE_SIGN = 0x02
+CALIBRATION_AUTOMATIC = 0x04
+CALIBRATION_CONTINUED = 0x08
+AMPLITUDE_RANGES = {
+    310: ((0x10, 'PEAKTOPEAK'), (0x20, 'ZEROTOPEAK'), (0x40, 'RMS')),
+    320: ((0x10, 'RANDOM'),),
+}
+
+# Record lengths allowed by blockette 1000, as powers of 2
+RECORD_LENGTH_EXPONENTS = range(7, 21)
+
+# Data quality indicators (field 2) and their publication versions
+PUBLICATION_VERSIONS = {b'R': 1, b'D': 2, b'Q': 3, b'M': 4}
+
+# Activity flag bits (field 12) and their extra headers
+ACTIVITY_CALIBRATION = 0x01
+ACTIVITY_CORRECTION_APPLIED = 0x02
+ACTIVITY_POSITIVE_LEAP = 0x10
+ACTIVITY_NEGATIVE_LEAP = 0x20
+EVENT_HEADERS = (
+    (0x04, 'Begin'),
+    (0x08, 'End'),
+    (0x40, 'InProgress'),
+)
+
+# I/O and data quality flag bits (fields 13 and 14) and their extra
+# headers
+IO_CLOCK_LOCKED = 0x20
+IO_HEADERS = (
+    (0x01, 'StationVolumeParityError'),
+    (0x02, 'LongRecordRead'),
+    (0x04, 'ShortRecordRead'),
+    (0x08, 'StartOfTimeSeries'),
+    (0x10, 'EndOfTimeSeries'),
+)
+QUALITY_TIME_QUESTIONABLE = 0x80
+QUALITY_HEADERS = (
+    (0x01, 'AmplifierSaturation'),
+    (0x02, 'DigitizerClipping'),
+    (0x04, 'Spikes'),
+    (0x08, 'Glitches'),
+    (0x10, 'MissingData'),
+    (0x20, 'TelemetrySyncError'),
+    (0x40, 'FilterCharging'),
+)
+
+# Flags of the V3 header (field 3)
+FLAG_CALIBRATION = 0x01
+FLAG_TIME_QUESTIONABLE = 0x02
+FLAG_CLOCK_LOCKED = 0x04
+
+# Encodings retired in V3 that are decoded and re-encoded, with their
+# sample sizes.  The samples are described by the data description
+# language in Appendix A of the SEED 2.4 manual: 24-bit integers, and
+# 16-bit gain ranged values with a 12-bit offset binary mantissa
+# divided by 2 to the power of a 3 or 4-bit exponent (GEOSCOPE), a
+# 14-bit offset binary mantissa and a 2-bit multiplier code (CDSN) or a
+# 12-bit mantissa multiplied by 2 to the power of 10 less a 4-bit gain
+# (SRO).  Encodings 15, 17 and 18 are not described there.
+ENCODING_INT24 = 2
+ENCODING_GEOSCOPE24 = 12
+ENCODING_GEOSCOPE163 = 13
+ENCODING_GEOSCOPE164 = 14
+ENCODING_CDSN = 16
+ENCODING_SRO = 30
+ENCODING_DWWSSN = 32
+LEGACY_SAMPLE_SIZES = {
+    ENCODING_INT24: 3,
+    ENCODING_GEOSCOPE24: 3,
+    ENCODING_GEOSCOPE163: 2,
+    ENCODING_GEOSCOPE164: 2,
+    ENCODING_CDSN: 2,
+    ENCODING_SRO: 2,
+    ENCODING_DWWSSN: 2,
+}
+GEOSCOPE_EXPONENT_MASKS = {ENCODING_GEOSCOPE163: 0x7, ENCODING_GEOSCOPE164: 0xf}
+CDSN_MULTIPLIERS = np.array([1, 4, 16, 128], dtype=np.int32)
+
+# Data encodings that are the same in both versions and are converted
+# without decompression, and retired encodings that are re-encoded.
+# Other 2.4 encodings are not defined in V3.
+CONVERTED_ENCODINGS = ((ENCODING_TEXT,) + tuple(SAMPLE_SIZES) + STEIM_ENCODINGS +
+                       tuple(LEGACY_SAMPLE_SIZES))
+
+# Big-endian types of fixed width encodings, byte swapped to the
+# little-endian order of V3
+SWAPPED_TYPES = {
+    1: np.dtype('>i2'),
+    3: np.dtype('>i4'),
+    4: np.dtype('>f4'),
+    5: np.dtype('>f8'),
+}
+
+# Conversions of little-endian Steim payloads to big-endian
+STEIM_SWAPS = {
+    ENCODING_STEIM1: steim.swap_steim1,
+    ENCODING_STEIM2: steim.swap_steim2,
+}
+
+ZERO_WORD = bytes(4)
+
+# Parsed FSDH and blockettes of a record
+MS2Header = collections.namedtuple('MS2Header', [
+    'order',       # Byte order of the header, '<' or '>'
+    'fields',      # Tuple of unpacked FSDH fields
+    'blockettes',  # List of (type, offset) in record order
+    'encoding',
+    'word_order',  # Byte order of the data, '<' or '>'
+    'length',
+])
+
+ConversionReport = collections.namedtuple('ConversionReport', [
+    'path',
+    'records',
+    'bytes_in',
+    'bytes_out',
+    'errors',   # List of (offset, message)
+    'dropped',  # Counter of dropped blockettes by type
+])
+
+
+# Return the byte order of the header at offset, detected from a valid
+# year and day of the start time as done by libmseed
+def header_byte_order(buffer, offset):
+    for order in '><':
+        year, day = YEAR_DAY[order].unpack_from(buffer, offset + YEAR_OFFSET)
+        if 1900 <= year <= 2100 and 1 <= day <= 366:
+            return order
+    raise ValueError(f'miniSEED 2 record not found at offset {offset}')
+
+
+# Parse the FSDH and blockette chain of the record at offset.  Return
+# an MS2Header, or None if more than end - offset bytes are needed to
+# find the record length.
+def parse_header(buffer, offset, end):
+    if end - offset < FSDH_LENGTH:
+        return None
+
+    order = header_byte_order(buffer, offset)
+    fields = FSDH[order].unpack_from(buffer, offset)
+    if fields[1] not in PUBLICATION_VERSIONS:
+        raise ValueError(f'Invalid data quality indicator {fields[1]!r} at offset {offset}')
+
+    blockettes = []
+    encoding = word_order = length = None
+    position = fields[-1]
+    while position:
+        if offset + position + BLOCKETTE_HEADER[order].size > end:
+            return None
+        kind, following = BLOCKETTE_HEADER[order].unpack_from(buffer, offset + position)
+        if offset + position + BLOCKETTE_LENGTHS.get(kind, BLOCKETTE_HEADER[order].size) > end:
+            return None
+        blockettes.append((kind, position))
+
+        if kind == 1000:
+            encoding, word_order, exponent = B1000.unpack_from(buffer, offset + position + 4)
+            if exponent not in RECORD_LENGTH_EXPONENTS:
+                raise ValueError(f'Invalid record length exponent {exponent} at offset {offset}')
+            word_order = '>' if word_order else '<'
+            length = 1 << exponent
+
+        if following and following <= position:
+            raise ValueError(f'Invalid blockette chain at offset {offset}')
+        position = following
+
+    if length is None:
+        raise ValueError(f'No blockette 1000 in record at offset {offset}')
+
+    return MS2Header(order, fields, blockettes, encoding, word_order, length)
+
+
+# Iterate over the records of a binary file object as (offset, header,
+# record view).  The views share a single buffer and are only valid
+# until the next record is read.
+def iter_ms2_records(fp, buffer_size=DEFAULT_BUFFER_SIZE):
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    start = end = 0
+    position = 0  # File offset of buffer[start]
+    eof = False
+
+    while True:
+        header = parse_header(view, start, end)
+        if header is not None and start + header.length <= end:
+            yield position, header, view[start:start + header.length]
+            start += header.length
+            position += header.length
+            continue
+
+        available = end - start
+        if eof:
+            if available:
+                raise ValueError(f'Truncated record at offset {position}')
+            return
+
+        # Move the partial record to the front of the buffer, growing
+        # it if the record is larger, and refill
+        needed = header.length if header is not None else FSDH_LENGTH
+        if needed > len(buffer):
+            buffer = bytearray(needed)
+            buffer[:available] = view[start:end]
+            view = memoryview(buffer)
+        elif start:
+            view[:available] = view[start:end]
+        elif available == len(buffer):
+            raise ValueError(f'Blockette chain too long at offset {position}')
+        start, end = 0, available
+
+        count = fp.readinto(view[end:])
+        if not count:
+            eof = True
+        end += count
+
+
+# Return the FDSN source identifier of network, station, location and
+# channel codes.  Three character channel codes are split into band,
+# source and subsource codes.
+def source_identifier(network, station, location, channel):
+    network, station, location, channel = (
+        code.decode('ascii').strip() for code in (network, station, location, channel))
+    if len(channel) == 3:
+        channel = '_'.join(channel)
+    return f'FDSN:{network}_{station}_{location}_{channel}'
+
+
+# Return the nominal sample rate in Hz of the sample rate factor and
+# multiplier (fields 10 and 11)
+def nominal_sample_rate(factor, multiplier):
+    if factor > 0 and multiplier > 0:
+        return float(factor * multiplier)
+    if factor > 0 and multiplier < 0:
+        return -factor / multiplier
+    if factor < 0 and multiplier > 0:
+        return -multiplier / factor
+    if factor < 0 and multiplier < 0:
+        return 1.0 / (factor * multiplier)
+    return 0.0
+
+
+# Return the sample rate/period value (field 6) of a sample rate.  Rates
+# below 1 Hz with a whole number period are stored as a negative
+# period.
+def sample_rate_period(rate):
+    if 0.0 < rate < 1.0:
+        period = round(1.0 / rate)
+        if abs(period * rate - 1.0) < 1e-6:
+            return float(-period)
+    return rate
+
+
+# Return the start time fields (4a-4f) of BTIME fields and an offset in
+# nanoseconds.  The fields are kept as they are when the offset stays
+# within the second, preserving leap seconds.
+def start_fields(year, day, hour, minute, second, fraction, offset_ns):
+    nanosecond = fraction * 100000 + offset_ns
+    if 0 <= nanosecond < NS_PER_SECOND:
+        return (year, day, hour, minute, second, nanosecond)
+    return nstime_to_fields(fields_to_nstime(year, day, hour, minute, second, 0) + nanosecond)
+
+
+# Return the string of a fixed length blockette text field
+def blockette_text(value):
+    return value.decode('ascii', 'replace').rstrip(' \0')
+
+
+# Return the ISO time string of BTIME fields
+def btime_to_isotime(year, day, hour, minute, second, fraction):
+    return nstime_to_isotime(fields_to_nstime(year, day, hour, minute, second,
+                                              fraction * 100000))
+
+
+# Return a blockette 500 as an FDSN.Time.Exception entry and the clock
+# model
+def timing_exception(record, order, position):
+    (vco_correction, year, day, hour, minute, second, fraction, microsecond,
+     reception_quality, count, kind, model, status) = B500[order].unpack_from(record, position + 4)
+    exception_time = fields_to_nstime(year, day, hour, minute, second,
+                                      fraction * 100000 + microsecond * 1000)
+    exception = {
+        'Time': nstime_to_isotime(exception_time),
+        'VCOCorrection': vco_correction,
+        'ReceptionQuality': reception_quality,
+        'Count': count,
+        'Type': blockette_text(kind),
+        'ClockStatus': blockette_text(status),
+    }
+    return exception, blockette_text(model)
+
+
+# Return a blockette 200 or 201 as an FDSN.Event.Detection entry
+def event_detection(record, order, kind, position):
+    if kind == 200:
+        (amplitude, period, background, flags,
+         *onset, detector) = B200[order].unpack_from(record, position + 4)
+    else:
+        (amplitude, period, background, flags,
+         *onset, snr, lookback, pick, detector) = B201[order].unpack_from(record, position + 4)
+
+    detection = {
+        'Type': DETECTIONS[kind],
+        'SignalAmplitude': amplitude,
+        'SignalPeriod': period,
+        'BackgroundEstimate': background,
+        'Wave': 'DILATATION' if flags & DETECTION_DILATATION else 'COMPRESSION',
+    }
+    if kind == 200:
+        detection['Units'] = 'DECONVOLVED' if flags & DETECTION_DECONVOLVED else 'COUNTS'
+    detection['OnsetTime'] = btime_to_isotime(*onset)
+    if kind == 201:
+        detection['MEDSNR'] = list(snr)
+        detection['MEDLookback'] = lookback
+        detection['MEDPickAlgorithm'] = pick
+    detection['Detector'] = blockette_text(detector)
+    return detection
+
+
+# Return a blockette 300, 310, 320 or 390 as an
+# FDSN.Calibration.Sequence entry.  Durations are in units of 0.0001
+# seconds.
+def calibration_sequence(record, order, kind, position):
+    fields = CALIBRATION_BLOCKETTES[kind][order].unpack_from(record, position + 4)
+    values = fields[6:]
+    if kind == 300:
+        steps, flags, duration, between, amplitude, channel, reference, coupling, rolloff = values
+    elif kind == 310:
+        flags, duration, period, amplitude, channel, reference, coupling, rolloff = values
+    elif kind == 320:
+        flags, duration, amplitude, channel, reference, coupling, rolloff, noise = values
+    else:
+        flags, duration, amplitude, channel = values
+
+    sequence = {'Type': CALIBRATIONS[kind], 'BeginTime': btime_to_isotime(*fields[:6])}
+    if kind == 300:
+        sequence['Steps'] = steps
+        sequence['StepFirstPulsePositive'] = bool(flags & CALIBRATION_FIRST_PULSE_POSITIVE)
+        sequence['StepAlternateSign'] = bool(flags & CALIBRATION_ALTERNATE_SIGN)
+    sequence['Trigger'] = 'AUTOMATIC' if flags & CALIBRATION_AUTOMATIC else 'MANUAL'
+    sequence['Continued'] = bool(flags & CALIBRATION_CONTINUED)
+    for bit, name in AMPLITUDE_RANGES.get(kind, ()):
+        if flags & bit:
+            sequence['AmplitudeRange'] = name
+            break
+    sequence['Duration'] = duration / 10000
+    if kind == 300:
+        sequence['StepBetween'] = between / 10000
+    elif kind == 310:
+        sequence['SinePeriod'] = period
+    sequence['Amplitude'] = amplitude
+    sequence['InputChannel'] = blockette_text(channel)
+    if kind != 390:
+        sequence['ReferenceAmplitude'] = reference
+        sequence['Coupling'] = blockette_text(coupling)
+        sequence['Rolloff'] = blockette_text(rolloff)
+    if kind == 320:
+        sequence['Noise'] = blockette_text(noise)
+    return sequence
+
+
+# Return the samples of a payload in a retired encoding, integers as
+# int32 and gain ranged GEOSCOPE values as float32
+def decode_legacy(payload, encoding, word_order, number_samples):
+    length = number_samples * LEGACY_SAMPLE_SIZES[encoding]
+    if length > len(payload):
+        raise ValueError(f'Payload of {len(payload)} bytes is too short '
+                         f'for {number_samples} samples')
+
+    if LEGACY_SAMPLE_SIZES[encoding] == 3:
+        data = np.frombuffer(payload, dtype=np.uint8, count=length).reshape(-1, 3)
+        if word_order == '<':
+            data = data[:, ::-1]
+        words = data.astype(np.int32)
+        # Assemble at the top of the word and shift down to sign extend
+        return (words[:, 0] << 24 | words[:, 1] << 16 | words[:, 2] << 8) >> 8
+
+    words = np.frombuffer(payload, dtype=word_order + 'u2', count=number_samples).astype(np.int32)
+    if encoding == ENCODING_DWWSSN:
+        return (words << 16) >> 16
+    if encoding in GEOSCOPE_EXPONENT_MASKS:
+        exponents = (words >> 12) & GEOSCOPE_EXPONENT_MASKS[encoding]
+        return np.ldexp((words & 0x0fff) - 2048, -exponents).astype(np.float32)
+    if encoding == ENCODING_CDSN:
+        return ((words & 0x3fff) - 0x1fff) * CDSN_MULTIPLIERS[words >> 14]
+
+    exponents = 10 - (words >> 12)
+    if np.any(exponents < 0):
+        raise ValueError(f'Invalid SRO gain range {10 - exponents.min()}')
+    return ((words << 20) >> 20) << exponents
+
+
+# Return the encoding and payload of samples decoded from a retired
+# encoding.  The differences of integer samples of at most 24 bits
+# always fit Steim-2, GEOSCOPE gain ranged values are exact as 32-bit
+# floats.
+def encode_legacy(samples):
+    if samples.dtype == np.float32:
+        return ENCODING_FLOAT32, samples.astype('<f4').tobytes()
+    payload, _ = steim.encode_steim2(samples)
+    return ENCODING_STEIM2, payload
+
+
+# Return the encoding and payload of a record converted to V3, with
+# fixed width samples in little-endian byte order, Steim payloads
+# trimmed to the frames in use and retired encodings re-encoded
+def convert_payload(record, header, number_samples, frame_count):
+    encoding = header.encoding
+    data_offset = header.fields[-2]
+    if encoding in LEGACY_SAMPLE_SIZES:
+        samples = decode_legacy(record[data_offset:], encoding, header.word_order,
+                                number_samples if data_offset else 0)
+        return encode_legacy(samples)
+    if not number_samples or not data_offset:
+        return encoding, b''
+    payload = record[data_offset:]
+
+    if encoding in STEIM_ENCODINGS:
+        frames = len(payload) // STEIM_FRAME_LENGTH
+        if 0 < frame_count < frames:
+            frames = frame_count
+        while frames > 1 and payload[(frames - 1) * STEIM_FRAME_LENGTH:
+                                     (frames - 1) * STEIM_FRAME_LENGTH + 4] == ZERO_WORD:
+            frames -= 1
+        payload = payload[:frames * STEIM_FRAME_LENGTH]
+        if header.word_order == '<':
+            if encoding not in STEIM_SWAPS:
+                raise ValueError(f'Cannot convert little-endian data encoding {encoding}')
+            return encoding, STEIM_SWAPS[encoding](payload)
+        return encoding, payload
+
+    length = number_samples * SAMPLE_SIZES.get(encoding, 1)
+    if length > len(payload):
+        raise ValueError(f'Payload of {len(payload)} bytes is too short '
+                         f'for {number_samples} samples')
+    if encoding in SWAPPED_TYPES and header.word_order == '>':
+        samples = np.frombuffer(payload, dtype=SWAPPED_TYPES[encoding], count=number_samples)
+        return encoding, samples.astype(SWAPPED_TYPES[encoding].newbyteorder('<')).tobytes()
+    return encoding, payload[:length]
+
+
+# Convert a record to an MS3Record.  With all_headers the sequence
+# number and data quality indicator are also kept as extra headers.
+def convert_record(record, header, all_headers=False):
+    (sequence, quality, station, location, channel, network,
+     year, day, hour, minute, second, fraction, number_samples,
+     factor, multiplier, activity, io_clock, data_quality, _,
+     correction, _, _) = header.fields
+    order = header.order
+
+    if header.encoding not in CONVERTED_ENCODINGS:
+        raise ValueError(f'Cannot convert data encoding {header.encoding}')
+
+    rate = nominal_sample_rate(factor, multiplier)
+    time_headers = {}
+    event_headers = {}
+    exceptions = []
+    detections = []
+    calibrations = []
+    clock_model = ''
+    microsecond = 0
+    frame_count = 0
+
+    for kind, position in header.blockettes:
+        if kind == 100:
+            rate = float(B100[order].unpack_from(record, position + 4)[0])
+        elif kind == 1001:
+            timing_quality, microsecond, frame_count = B1001.unpack_from(record, position + 4)
+            time_headers['Quality'] = timing_quality
+        elif kind == 500:
+            exception, model = timing_exception(record, order, position)
+            exceptions.append(exception)
+            clock_model = clock_model or model
+        elif kind in DETECTIONS:
+            detections.append(event_detection(record, order, kind, position))
+        elif kind in CALIBRATIONS:
+            calibrations.append(calibration_sequence(record, order, kind, position))
+
+    # An unapplied time correction is applied to the start time, as
+    # done by libmseed
+    offset_ns = microsecond * 1000
+    if correction:
+        time_headers['Correction'] = correction / 10000
+        if not activity & ACTIVITY_CORRECTION_APPLIED:
+            offset_ns += correction * 100000
+
+    if activity & ACTIVITY_POSITIVE_LEAP:
+        time_headers['LeapSecond'] = 1
+    elif activity & ACTIVITY_NEGATIVE_LEAP:
+        time_headers['LeapSecond'] = -1
+    if exceptions:
+        time_headers['Exception'] = exceptions
+
+    for bit, name in EVENT_HEADERS:
+        if activity & bit:
+            event_headers[name] = True
+    if detections:
+        event_headers['Detection'] = detections
+
+    flag_headers = {name: True for bit, name in IO_HEADERS if io_clock & bit}
+    flag_headers.update((name, True) for bit, name in QUALITY_HEADERS if data_quality & bit)
+
+    fdsn = {}
+    for name, value in (('Time', time_headers), ('Event', event_headers),
+                        ('Flags', flag_headers)):
+        if value:
+            fdsn[name] = value
+    if clock_model:
+        fdsn['Clock'] = {'Model': clock_model}
+    if calibrations:
+        fdsn['Calibration'] = {'Sequence': calibrations}
+    if all_headers:
+        fdsn['DataQuality'] = quality.decode('ascii')
+        if sequence.strip().isdigit():
+            fdsn['Sequence'] = int(sequence)
+
+    extra_header = b''
+    if fdsn:
+        extra_header = json.dumps({'FDSN': fdsn}, separators=(',', ':')).encode('utf-8')
+
+    flags = ((FLAG_CALIBRATION if activity & ACTIVITY_CALIBRATION else 0) |
+             (FLAG_TIME_QUESTIONABLE if data_quality & QUALITY_TIME_QUESTIONABLE else 0) |
+             (FLAG_CLOCK_LOCKED if io_clock & IO_CLOCK_LOCKED else 0))
+
+    encoding, payload = convert_payload(record, header, number_samples, frame_count)
+
+    return MS3Record(
+        source_identifier(network, station, location, channel),
+        *start_fields(year, day, hour, minute, second, fraction, offset_ns),
+        encoding=encoding,
+        sample_rate_period=sample_rate_period(rate),
+        number_samples=number_samples,
+        pub_version=PUBLICATION_VERSIONS[quality],
+        flags=flags,
+        extra_header=extra_header,
+        payload=payload)
+
+
+# Convert all records of an input file object to a RecordWriter.
+# Records that cannot be converted are skipped and reported, framing
+# errors stop the conversion.  Return (records, bytes read, errors,
+# dropped blockettes).
+def convert_stream(fp, writer, all_headers=False):
+    errors = []
+    dropped = collections.Counter()
+    records = 0
+    length = 0
+
+    try:
+        for offset, header, record in iter_ms2_records(fp):
+            length = offset + header.length
+            try:
+                writer.write(convert_record(record, header, all_headers))
+            except (ValueError, UnicodeDecodeError) as error:
+                errors.append((offset, str(error)))
+                continue
+            records += 1
+            dropped.update(kind for kind, _ in header.blockettes if kind not in BLOCKETTE_LENGTHS)
+    except ValueError as error:
+        errors.append((length, str(error)))
+
+    return records, length, errors, dropped
+
+
+# Convert a single file to output_path, return a ConversionReport
+def convert_file(path, output_path, all_headers=False):
+    try:
+        with open(path, 'rb') as fp, open(output_path, 'wb') as output:
+            with RecordWriter(output) as writer:
+                records, length, errors, dropped = convert_stream(fp, writer, all_headers)
+    except OSError as error:
+        return ConversionReport(path, 0, 0, 0, [(0, str(error))], collections.Counter())
+    return ConversionReport(path, records, length, writer.byte_count, errors, dropped)
+
+
+# Convert (input, output) path pairs in parallel, yielding a
+# ConversionReport for each in order
+def convert_files(pairs, all_headers=False, workers=None):
+    pairs = list(pairs)
+    if workers == 1:
+        for path, output_path in pairs:
+            yield convert_file(path, output_path, all_headers)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(pairs) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(functools.partial(convert_file, all_headers=all_headers),
+                                *zip(*pairs), chunksize=chunksize)
+
+
+# Return the output path in directory for an input path
+def output_path(directory, path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, name + '.mseed3')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert miniSEED 2.4 files to miniSEED V3.')
+
+    parser.add_argument('files', nargs='+',
+                        help='miniSEED 2.4 files to convert')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='Output file for all records (default is stdout)')
+    parser.add_argument('-d', '--directory', dest='directory', default=None,
+                        help='Convert each file to a .mseed3 file in this directory')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Number of worker processes with -d (default is number of CPUs)')
+    parser.add_argument('-a', '--all-headers', dest='all_headers', action='store_true',
+                        help='Keep sequence numbers and quality indicators as extra headers')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
+                        help='Only print the summary')
+
+    args = parser.parse_args()
+
+    if args.directory is not None and args.output is not None:
+        parser.error('-o and -d cannot be used together')
+
+    start = time.perf_counter()
+    files = records = bytes_in = bytes_out = errors = dropped = 0
+
+    if args.directory is not None:
+        os.makedirs(args.directory, exist_ok=True)
+        reports = convert_files(((path, output_path(args.directory, path))
+                                 for path in args.files),
+                                args.all_headers, args.jobs)
+    else:
+        reports = []
+        output = (open(args.output, 'wb') if args.output is not None
+                  else sys.stdout.buffer)
+        with output, RecordWriter(output) as writer:
+            for path in args.files:
+                start_bytes = writer.byte_count
+                with open(path, 'rb') as fp:
+                    count, length, file_errors, file_dropped = convert_stream(
+                        fp, writer, args.all_headers)
+                writer.flush()
+                reports.append(ConversionReport(path, count, length,
+                                                writer.byte_count - start_bytes,
+                                                file_errors, file_dropped))
+
+    for report in reports:
+        files += 1
+        records += report.records
+        bytes_in += report.bytes_in
+        bytes_out += report.bytes_out
+        errors += len(report.errors)
+        dropped += sum(report.dropped.values())
+        if not args.quiet:
+            for offset, message in report.errors:
+                print(f'{report.path} {offset}: {message}', file=sys.stderr)
+            if report.dropped:
+                print(f'{report.path}: dropped blockettes ' +
+                      ', '.join(f'{kind} ({count})' for kind, count in sorted(report.dropped.items())),
+                      file=sys.stderr)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{files} files, {records} records, {bytes_in} bytes in, '
+          f'{bytes_out} bytes out, {errors} errors, {dropped} blockettes dropped '
+          f'in {elapsed:.2f} s '
+          f'({records / elapsed:.0f} records/s, {bytes_in / elapsed / 1e6:.1f} MB/s)',
+          file=sys.stderr)
+
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Generate a large synthetic archive of miniSEED V3 records for
+# benchmarking.
+#
+# Each channel repeats the record that generate_miniseed3.py builds for
+# one of the sinusoid payloads, with contiguous start times.  Channels
+# are grouped in files of one station with three components and the
+# files are written in parallel by a pool of worker processes.  The
+# archive is determined by the seed alone: every choice is drawn from
+# generators seeded with it and the file number, so the same files are
+# written whatever the number of workers.
+
+import os
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from build_reference_data import EXTRA_HEADERS
+from generate_miniseed3 import parse_args, build_record
+from ms3record import (MS3Record, RecordWriter, record_length, nstime_to_fields,
+                       isotime_to_nstime, sample_interval_ns)
+
+PAYLOADS = ('int16', 'int32', 'float32', 'float64', 'steim1', 'steim2')
+
+# Sample rate/periods with their SEED band codes
+RATES = ((1.0, 'L'), (20.0, 'B'), (40.0, 'B'), (100.0, 'H'), (200.0, 'H'), (-10.0, 'V'))
+
+COMPONENTS = ('Z', 'N', 'E')
+
+EXTRA_HEADER_FILE = os.path.join(EXTRA_HEADERS, 'Example-ExtraHeaders-FDSN-TQ-ED.json')
+
+DEFAULT_START = '2022-06-05T00:00:00Z'
+
+# Records of a channel and the file of a station
+Channel = collections.namedtuple('Channel', [
+    'identifier',
+    'payload',
+    'sample_rate_period',
+    'start_time',
+])
+
+FileTask = collections.namedtuple('FileTask', [
+    'path',
+    'seed',
+    'number',
+    'channels',
+    'records',  # Records per channel
+    'extra_fraction',  # Fraction of records with extra headers
+])
+
+
+# Parse a size in bytes with an optional K, M, G or T suffix (powers of
+# 1024), e.g. 1G
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    scale = 1
+    if text and text[-1] in 'KMGT':
+        scale = 1024 ** ('KMGT'.index(text[-1]) + 1)
+        text = text[:-1]
+    return int(float(text) * scale)
+
+
+# Return the record template of a channel, with extra headers if
+# extra_header is True, as built by generate_miniseed3.py
+def channel_template(channel, extra_header=False):
+    arguments = ['-p', channel.payload, '-i', channel.identifier,
+                 '-s', repr(channel.sample_rate_period)]
+    if extra_header:
+        arguments += ['-e', EXTRA_HEADER_FILE]
+    return build_record(parse_args(arguments))
+
+
+# Return the channels of the archive, in files of one station each.
+# Payloads, rates and start offsets within a sample period are drawn
+# from a generator seeded with seed.
+def plan_channels(seed, number_channels, payloads, start_time):
+    rng = np.random.default_rng(seed)
+    stations = []
+    for station in range(-(-number_channels // len(COMPONENTS))):
+        rate, band = RATES[rng.integers(len(RATES))]
+        payload = payloads[rng.integers(len(payloads))]
+        count = min(len(COMPONENTS), number_channels - station * len(COMPONENTS))
+        offsets = rng.integers(sample_interval_ns(rate), size=count)
+        stations.append([Channel(f'FDSN:XX_S{station:05d}__{band}_H_{component}',
+                                 payload, rate, start_time + int(offset))
+                         for component, offset in zip(COMPONENTS, offsets)])
+    return stations
+
+
+# Write the records of a file, return (path, records, bytes)
+def generate_file(task):
+    rng = np.random.default_rng((task.seed, task.number))
+
+    with open(task.path, 'wb') as fp, RecordWriter(fp) as writer:
+        for channel in task.channels:
+            templates = (channel_template(channel), channel_template(channel, True))
+            extra = (rng.random(task.records) < task.extra_fraction).tolist()
+            interval = sample_interval_ns(channel.sample_rate_period, templates[0].number_samples)
+            nstime = channel.start_time
+
+            for record in range(task.records):
+                template = templates[extra[record]]
+                writer.write(MS3Record(template.identifier, *nstime_to_fields(nstime),
+                                       *template[7:]))
+                nstime += interval
+
+        return task.path, writer.record_count, writer.byte_count
+
+
+# Return the number of records per channel for an archive of at least
+# size bytes
+def records_for_size(stations, size, extra_fraction):
+    channel_bytes = 0.0
+    for channels in stations:
+        for channel in channels:
+            plain = record_length(channel_template(channel))
+            extra = record_length(channel_template(channel, True))
+            channel_bytes += plain + (extra - plain) * extra_fraction
+    return max(1, -(-size // int(channel_bytes))) if channel_bytes else 0
+
+
+# Generate the archive files in parallel, yielding (path, records,
+# bytes) of each in order
+def generate_archive(tasks, workers=None):
+    tasks = list(tasks)
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield generate_file(task)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(generate_file, tasks, chunksize=chunksize)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic miniSEED V3 archive for benchmarking.')
+
+    parser.add_argument('output',
+                        help='Output directory, created if needed')
+    parser.add_argument('-c', '--channels', dest='channels', default=3000, type=int,
+                        help='Number of channels (default 3000)')
+    parser.add_argument('-n', '--records', dest='records', default=None, type=int,
+                        help='Records per channel (default chosen by --size)')
+    parser.add_argument('-S', '--size', dest='size', default='1G',
+                        help='Approximate archive size, e.g. 500M or 2G (default 1G)')
+    parser.add_argument('-p', '--payloads', dest='payloads', default=','.join(PAYLOADS),
+                        help=f'Comma separated payloads to choose from (default {",".join(PAYLOADS)})')
+    parser.add_argument('-x', '--extra', dest='extra', default=0.05, type=float,
+                        help='Fraction of records with extra headers (default 0.05)')
+    parser.add_argument('-t', '--start', dest='start', default=DEFAULT_START,
+                        help=f'Start time of the archive (default {DEFAULT_START})')
+    parser.add_argument('-s', '--seed', dest='seed', default=0, type=int,
+                        help='Seed of all random choices (default 0)')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Number of worker processes (default is number of CPUs)')
+
+    args = parser.parse_args()
+
+    payloads = tuple(args.payloads.split(','))
+    unknown = sorted(set(payloads) - set(PAYLOADS))
+    if unknown:
+        raise ValueError(f'Unknown payloads: {", ".join(unknown)}')
+
+    stations = plan_channels(args.seed, args.channels, payloads, isotime_to_nstime(args.start))
+    records = args.records
+    if records is None:
+        records = records_for_size(stations, parse_size(args.size), args.extra)
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = [FileTask(os.path.join(args.output, f'XX.S{number:05d}.mseed3'),
+                      args.seed, number, channels, records, args.extra)
+             for number, channels in enumerate(stations)]
+
+    start = time.perf_counter()
+    total_records = total_bytes = 0
+    for _, record_count, byte_count in generate_archive(tasks, args.jobs):
+        total_records += record_count
+        total_bytes += byte_count
+    elapsed = time.perf_counter() - start
+
+    print(f'{len(tasks)} files, {args.channels} channels, {total_records} records, '
+          f'{total_bytes} bytes in {elapsed:.2f} s '
+          f'({total_bytes / elapsed / 1e6:.1f} MB/s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
@@ -4,14 +4,15 @@
 # pre-prepared data payloads.
 
 import sys
-import struct
 import argparse
-import crcmod.predefined
 import base64
 import json
 
+from ms3record import MS3Record, write_records
 
-def main():
+
+# Parse command line arguments, from sys.argv if argv is None
+def parse_args(argv=None):
 
     parser = argparse.ArgumentParser(description='Generate a miniSEED V3 record.')
 
@@ -40,11 +41,11 @@ def main():
     parser.add_argument('-p', '--payload', dest='payload', default='nopayload',
                         help='Select desired payload (text, int16, int32, float32, float64, steim1, steim2)')
 
-    args = parser.parse_args()
+    return parser.parse_args(argv)
 
 
-    length_identifier = len(args.identifier)
-    format_version = 3
+# Return the MS3Record described by parsed command line arguments
+def build_record(args):
 
     # Convert binary bit mask string "00000000" to an integer flags value
     flags = int(args.flags, 2)
@@ -57,89 +58,46 @@ def main():
             extra_header = json.dumps(extra_header, separators=(',', ':'))
             extra_header = extra_header.encode('utf-8')
 
-    length_extra_header = len(extra_header)
-
     # Configure payload details
     (payload, encoding, number_samples) = set_payload (args.payload)
 
     if payload is None:
-        print(f"Payload value '{args.payload}' is not recognized", file=sys.stderr)
-        exit(1)
+        raise ValueError(f"Payload value '{args.payload}' is not recognized")
 
     # Set sample rate to something other than zero for non-text payloads
-    if args.payload != 'text' and args.sample_rate_period == 0.0:
-        args.sample_rate_period = 1.0
-
-    length_payload = len(payload)
-
-
-    # miniSEED 3 Fixed Section of Data Header
-    # 40 bytes, plus length of identifier, plus length of extra headers
-    #
-    # #  FIELD                   TYPE       OFFSET
-    # 1  record indicator        char[2]       0
-    # 2  format version          uint8_t       2
-    # 3  flags                   uint8_t       3
-    # 4a nanosecond              uint32_t      4
-    # 4b year                    uint16_t      8
-    # 4c day                     uint16_t     10
-    # 4d hour                    uint8_t      12
-    # 4e min                     uint8_t      13
-    # 4f sec                     uint8_t      14
-    # 5  data encoding           uint8_t      15
-    # 6  sample rate/period      float64      16
-    # 7  number of samples       uint32_t     24
-    # 8  CRC of record           uint32_t     28
-    # 9  publication version     uint8_t      32
-    # 10 length of identifer     uint8_t      33
-    # 11 length of extra headers uint16_t     34
-    # 12 length of data payload  uint32_t     36
-    # 13 source identifier       char         40
-    # 14 extra headers           char         40 + field 10
-    # 15 data payload            encoded      40 + field 10 + field 11
-
-    # Python struct codes:
-    # < = little endian
-    # s = char[]
-    # B = unsigned char (8 bits)
-    # H = unsigned short (16 bits)
-    # L = unsigned long (32 bits)
-    # d = double (64 bits)
-
-    # Pack record header, little-endian binary values
-    ms3record0 = (struct.pack('<2sBBLHHBBBBdLLBBHL',
-                              b'MS',
-                              format_version,
-                              flags,
-                              args.nanosecond,
-                              args.year,
-                              args.day,
-                              args.hour,
-                              args.minute,
-                              args.second,
-                              encoding,
-                              args.sample_rate_period,
-                              number_samples,
-                              0, # Initial CRC is 0
-                              args.pub_version,
-                              length_identifier,
-                              length_extra_header,
-                              length_payload) +
-                  args.identifier.encode("ascii") +
-                  extra_header +
-                  payload)
-
-    # Calculate CRC32C of record
-    crc32c_func = crcmod.predefined.mkCrcFun('crc-32c')
-    crc_value = crc32c_func(ms3record0)
-
-    # Reconstruct the record, replacing the calculated CRC
-    ms3record = (ms3record0[:28] +
-                 struct.pack ('<L', crc_value) +
-                 ms3record0[32:])
+    sample_rate_period = args.sample_rate_period
+    if args.payload != 'text' and sample_rate_period == 0.0:
+        sample_rate_period = 1.0
+
+    # See ms3record.py for the header layout
+    return MS3Record(identifier=args.identifier,
+                     year=args.year,
+                     day=args.day,
+                     hour=args.hour,
+                     minute=args.minute,
+                     second=args.second,
+                     nanosecond=args.nanosecond,
+                     encoding=encoding,
+                     sample_rate_period=sample_rate_period,
+                     number_samples=number_samples,
+                     pub_version=args.pub_version,
+                     flags=flags,
+                     extra_header=extra_header,
+                     payload=payload)
+
+
+def main():
+
+    args = parse_args()
+
+    try:
+        record = build_record(args)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        exit(1)
 
     # Write binary record to stdout
-    sys.stdout.buffer.write (ms3record)
+    write_records(sys.stdout.buffer, [record])
 
 
 # Return (payload, encoding, number_samples) for specified choice
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+# Convert miniSEED V3 records to JSON or text.
+#
+# The output is the same as that of the mseed3-json and mseed3-text
+# converters from https://github.com/iris-edu/mseed3-utils used to
+# create the reference data.  Records are written as they are read,
+# samples are formatted in blocks directly from the decoded arrays.
+
+import sys
+import json
+import math
+import argparse
+
+from ms3reader import MS3File
+from ms3payload import DECODED_TYPES, decode_payload
+from ms3record import ENCODING_TEXT, ENCODING_FLOAT32, ENCODING_FLOAT64, nstime_to_isotime
+
+# Encoding descriptions, as printed by libmseed
+ENCODING_NAMES = {
+    0: 'Text',
+    1: '16-bit integer',
+    3: '32-bit integer',
+    4: '32-bit float (IEEE single)',
+    5: '64-bit float (IEEE double)',
+    10: 'STEIM-1 integer compression',
+    11: 'STEIM-2 integer compression',
+    19: 'STEIM-3 integer compression',
+    100: 'Opaque data',
+}
+
+# Descriptions of flag bits (field 3) for text output and their names
+# in JSON output
+FLAG_NAMES = (
+    (0, 'Calibration signals present', 'CalibrationSignalsPresent'),
+    (1, 'Time tag is questionable', 'TimeTagQuestionable'),
+    (2, 'Clock locked', 'ClockLocked'),
+)
+
+# Number of samples formatted per block
+BLOCK_SAMPLES = 6000
+
+# Text output sample formats and number of samples per line
+TEXT_COLUMNS = 6
+TEXT_FORMATS = {
+    ENCODING_FLOAT32: '%10.8g  ',
+    ENCODING_FLOAT64: '%10.10g  ',
+}
+TEXT_INTEGER_FORMAT = '%10d  '
+
+
+# Return the sample rate in Hz of a sample rate/period value (field 6)
+def sample_rate_hz(sample_rate_period):
+    if sample_rate_period < 0.0:
+        return 1.0 / -sample_rate_period
+    return sample_rate_period
+
+
+# Format a start time with microsecond resolution unless nanoseconds
+# are needed, as done by libmseed
+def text_time(record):
+    isotime = nstime_to_isotime(record.start_time)
+    if record.nanosecond % 1000 == 0:
+        isotime = isotime[:-4] + 'Z'
+    return f'{isotime} ({record.day:03d})'
+
+
+# Format a float for JSON output as mseed3-json does: the shortest
+# representation, in fixed notation from 1e-6 up to 1e21 and with a
+# trailing .0 for integral values.  NaN and infinities have no JSON
+# representation and are written as null.
+def json_float(value):
+    if not math.isfinite(value):
+        return 'null'
+    text = repr(value)
+    if 'e' not in text:
+        return text
+
+    mantissa, exponent = text.split('e')
+    exponent = int(exponent)
+    if not -6 <= exponent < 21:
+        return f'{mantissa}e{exponent:+d}'
+
+    sign = '-' if mantissa.startswith('-') else ''
+    digits = mantissa.lstrip('-').replace('.', '')
+    point = exponent + 1
+    if point <= 0:
+        return f'{sign}0.{"0" * -point}{digits}'
+    if point >= len(digits):
+        return f'{sign}{digits}{"0" * (point - len(digits))}.0'
+    return f'{sign}{digits[:point]}.{digits[point:]}'
+
+
+# Format a decoded JSON value with the given indent at a nesting level,
+# like json.dumps() but with floats formatted by json_float()
+def format_json(value, indent, level=0):
+    if isinstance(value, dict) or isinstance(value, list):
+        if not value:
+            return '{}' if isinstance(value, dict) else '[]'
+        inner = '\n' + ' ' * (indent * (level + 1))
+        if isinstance(value, dict):
+            items = (f'{json.dumps(key, ensure_ascii=False)}: '
+                     f'{format_json(item, indent, level + 1)}'
+                     for key, item in value.items())
+            brackets = '{}'
+        else:
+            items = (format_json(item, indent, level + 1) for item in value)
+            brackets = '[]'
+        return (brackets[0] + inner + (',' + inner).join(items) +
+                '\n' + ' ' * (indent * level) + brackets[1])
+    if isinstance(value, float):
+        return json_float(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+# Return True if the payload of a record can be decoded.  The samples of
+# other encodings, such as Steim-3 and opaque data, are not written.
+def decodable(record):
+    return record.encoding == ENCODING_TEXT or record.encoding in DECODED_TYPES
+
+
+# Yield blocks of samples as lists of Python values
+def sample_blocks(samples):
+    for start in range(0, len(samples), BLOCK_SAMPLES):
+        yield samples[start:start + BLOCK_SAMPLES].tolist()
+
+
+def write_json_record(record, fp):
+    flags = record.flags
+    fp.write('{\n'
+             f'    "SID": {json.dumps(record.identifier)},\n'
+             f'    "RecordLength": {record.length},\n'
+             f'    "FormatVersion": {record.format_version},\n'
+             '    "Flags": {\n'
+             f'        "RawUInt8": {flags}')
+    for bit, _, name in FLAG_NAMES:
+        if flags & (1 << bit):
+            fp.write(f',\n        "{name}": true')
+    fp.write('\n    },\n'
+             f'    "StartTime": "{nstime_to_isotime(record.start_time)}",\n'
+             f'    "EncodingFormat": {record.encoding},\n'
+             f'    "SampleRate": {json_float(sample_rate_hz(record.sample_rate_period))},\n'
+             f'    "SampleCount": {record.number_samples},\n'
+             f'    "CRC": "0x{record.crc:X}",\n'
+             f'    "PublicationVersion": {record.pub_version},\n'
+             f'    "ExtraLength": {record.length_extra_header},\n'
+             f'    "DataLength": {record.length_payload}')
+
+    if record.length_extra_header:
+        extra_header = record.extra_headers
+        fp.write(',\n    "ExtraHeaders": ' + format_json(extra_header, 4, 1))
+
+    if record.length_payload and decodable(record):
+        data = decode_payload(record.payload, record.encoding, record.number_samples)
+        fp.write(',\n    "Data": ')
+        if record.encoding == ENCODING_TEXT:
+            fp.write(json.dumps(data, ensure_ascii=False))
+        else:
+            separator = '['
+            for block in sample_blocks(data):
+                fp.write(separator + '\n        ')
+                fp.write(',\n        '.join(map(json_float if data.dtype.kind == 'f' else str, block)))
+                separator = ','
+            fp.write('\n    ]')
+
+    fp.write('\n}')
+
+
+# Write records as a JSON array
+def write_json(records, fp):
+    separator = '['
+    for record in records:
+        fp.write(separator)
+        write_json_record(record, fp)
+        separator = ','
+    fp.write('[]' if separator == '[' else ']')
+
+
+def write_text_record(record, fp):
+    flags = record.flags
+    fp.write(f'{record.identifier}, version {record.pub_version}, '
+             f'{record.length} bytes (format: {record.format_version})\n'
+             f'             start time: {text_time(record)}\n'
+             f'      number of samples: {record.number_samples}\n'
+             f'       sample rate (Hz): {sample_rate_hz(record.sample_rate_period):.10g}\n'
+             f'                  flags: [{flags:08b}] 8 bits\n')
+    for bit in range(8):
+        if flags & (1 << bit):
+            description = next((text for number, text, _ in FLAG_NAMES
+                                if number == bit), 'Undefined bit set')
+            fp.write(f'                         [Bit {bit}] {description}\n')
+    fp.write(f'                    CRC: 0x{record.crc:X}\n'
+             f'    extra header length: {record.length_extra_header} bytes\n'
+             f'    data payload length: {record.length_payload} bytes\n'
+             f'       payload encoding: {ENCODING_NAMES.get(record.encoding, "Unknown format code")}'
+             f' (val: {record.encoding})\n')
+
+    # Extra headers are printed without the enclosing root object
+    if record.length_extra_header:
+        extra_header = record.extra_headers
+        lines = json.dumps(extra_header, indent=2, ensure_ascii=False).split('\n')
+        fp.write('          extra headers:\n')
+        for line in lines[1:-1]:
+            fp.write(' ' * 14 + line + '\n')
+
+    if record.length_payload and decodable(record):
+        data = decode_payload(record.payload, record.encoding, record.number_samples)
+        fp.write('Data:\n')
+        if record.encoding == ENCODING_TEXT:
+            fp.write(data + '\n')
+        else:
+            value_format = TEXT_FORMATS.get(record.encoding, TEXT_INTEGER_FORMAT)
+            line_format = value_format * TEXT_COLUMNS + '\n'
+            for block in sample_blocks(data):
+                lines, remainder = divmod(len(block), TEXT_COLUMNS)
+                fp.write((line_format * lines + value_format * remainder) % tuple(block))
+                if remainder:
+                    fp.write('\n')
+
+
+# Write records as text
+def write_text(records, fp):
+    for record in records:
+        write_text_record(record, fp)
+
+
+# Iterate over the records of a sequence of files
+def iter_files(paths):
+    for path in paths:
+        with MS3File(path) as ms3file:
+            yield from ms3file
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert miniSEED V3 records to JSON or text.')
+
+    parser.add_argument('files', nargs='+',
+                        help='miniSEED V3 files to convert')
+    parser.add_argument('-f', '--format', dest='format', default='json',
+                        choices=('json', 'text'),
+                        help='Output format (default json)')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='Output file (default is stdout)')
+
+    args = parser.parse_args()
+
+    writer = write_json if args.format == 'json' else write_text
+
+    if args.output is None:
+        writer(iter_files(args.files), sys.stdout)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='\n') as fp:
+            writer(iter_files(args.files), fp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#
+# CRC-32C (Castagnoli) calculation for miniSEED V3 records.
+#
+# crc32c(data, value) follows the convention of zlib.crc32: passing the
+# CRC of preceding data as value continues the calculation, so a record
+# can be processed in pieces.  The fastest available backend is chosen
+# at import:
+#
+#   crc32c  - the crc32c package, hardware accelerated where supported
+#   crcmod  - the crcmod package C extension, table driven
+#   python  - table driven slicing-by-8 in pure Python
+#
+# The MS3CRC_BACKEND environment variable selects a specific backend.
+
+import os
+import struct
+
+# Reversed polynomial 0x1EDC6F41, see RFC 3309
+POLYNOMIAL = 0x82F63B78
+
+# Offset of the CRC in the fixed header, field 8
+CRC_OFFSET = 28
+CRC_LENGTH = 4
+ZERO_CRC = bytes(CRC_LENGTH)
+
+WORD_PAIR = struct.Struct('<LL')
+
+
+# Return slicing-by-8 lookup tables, table k gives the CRC contribution
+# of a byte followed by k zero bytes
+def make_tables():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (POLYNOMIAL if crc & 1 else 0)
+        table.append(crc)
+
+    tables = [table]
+    for _ in range(7):
+        previous = tables[-1]
+        tables.append([(crc >> 8) ^ table[crc & 0xFF] for crc in previous])
+
+    return tables
+
+
+TABLES = make_tables()
+
+
+# Table driven CRC-32C, eight bytes per step
+def python_crc32c(data, value=0):
+    t0, t1, t2, t3, t4, t5, t6, t7 = TABLES
+    data = memoryview(data).cast('B')
+    head = len(data) - len(data) % 8
+
+    crc = value ^ 0xFFFFFFFF
+    for low, high in WORD_PAIR.iter_unpack(data[:head]):
+        low ^= crc
+        crc = (t7[low & 0xFF] ^ t6[(low >> 8) & 0xFF] ^
+               t5[(low >> 16) & 0xFF] ^ t4[low >> 24] ^
+               t3[high & 0xFF] ^ t2[(high >> 8) & 0xFF] ^
+               t1[(high >> 16) & 0xFF] ^ t0[high >> 24])
+    for byte in data[head:]:
+        crc = t0[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+
+    return crc ^ 0xFFFFFFFF
+
+
+BACKENDS = {'python': python_crc32c}
+
+try:
+    import crcmod.predefined
+    crcmod_func = crcmod.predefined.mkCrcFun('crc-32c')
+    BACKENDS['crcmod'] = lambda data, value=0: crcmod_func(data, value)
+except ImportError:
+    pass
+
+try:
+    import crc32c as crc32c_module
+    BACKENDS['crc32c'] = lambda data, value=0: crc32c_module.crc32c(data, value)
+except ImportError:
+    pass
+
+BACKEND = os.environ.get('MS3CRC_BACKEND')
+if BACKEND is None:
+    BACKEND = next(name for name in ('crc32c', 'crcmod', 'python')
+                   if name in BACKENDS)
+elif BACKEND not in BACKENDS:
+    raise ImportError(f'CRC-32C backend {BACKEND} is not available')
+
+crc32c = BACKENDS[BACKEND]
+
+
+# Return the CRC of a complete record as defined for field 8, i.e. with
+# the CRC field taken as zero, without making a zeroed copy
+def record_crc(record):
+    crc = crc32c(record[:CRC_OFFSET])
+    crc = crc32c(ZERO_CRC, crc)
+    return crc32c(record[CRC_OFFSET + CRC_LENGTH:], crc)
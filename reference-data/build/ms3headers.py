@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+#
+# Archive index of miniSEED V3 extra headers.
+#
+# A single sidecar index file in the top directory of an archive lists,
+# for each file, the records that have extra headers with their time
+# spans, and which header paths and values appear in which records.
+# Queries for records with a header, optionally with a given value and
+# within a time window, are answered from the index.  Records are only
+# read when the index cannot decide, for paths with array positions or
+# for paths with too many distinct values to index.
+#
+# Paths are JSON pointers (RFC 6901), e.g. /FDSN/Event/Detection, with
+# array positions indexed as *, e.g. /FDSN/Event/Detection/*/Type.
+# Files are indexed in parallel and, when an index is updated, only
+# files that changed since it was saved are indexed again.
+
+import os
+import sys
+import json
+import argparse
+import itertools
+import collections
+import concurrent.futures
+
+from ms3reader import (MS3File, MISSING, find_files, parse_pointer,
+                       resolve_pointer, replace_file)
+from ms3record import nstime_to_isotime, isotime_to_nstime
+
+HEADER_INDEX_NAME = '.ms3headers.json'
+HEADER_INDEX_FORMAT = 'MS3HEADERS1'
+
+# Token matching any array position or object member
+ANY = '*'
+
+# Values of a path are not indexed in a file if it has more distinct
+# values than this, e.g. time corrections
+MAX_INDEXED_VALUES = 64
+
+
+# Return the JSON pointer of reference tokens
+def pointer_path(tokens):
+    return ''.join('/' + token.replace('~', '~0').replace('/', '~1')
+                   for token in tokens)
+
+
+# Return the tokens under which a path is indexed, with array positions
+# replaced by ANY
+def index_tokens(tokens):
+    return tuple(ANY if token.isdigit() else token for token in tokens)
+
+
+# Return the text a value is indexed by.  Integral floats are the same
+# value as the integer in JSON.
+def canonical_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+# Yield (path, value) for every member of a decoded document, with
+# MISSING as the value of objects and arrays
+def flatten(document, tokens=()):
+    if isinstance(document, dict):
+        items = document.items()
+    elif isinstance(document, list):
+        items = ((ANY, item) for item in document)
+    else:
+        yield pointer_path(tokens), document
+        return
+
+    if tokens:
+        yield pointer_path(tokens), MISSING
+    for key, item in items:
+        yield from flatten(item, tokens + (ANY if key.isdigit() else key,))
+
+
+# Yield all values at the tokens of a path in a decoded document, ANY
+# matching every array item and object member
+def iter_pointer(document, tokens):
+    if not tokens:
+        yield document
+        return
+
+    token, rest = tokens[0], tokens[1:]
+    if token != ANY:
+        document = resolve_pointer(document, (token,))
+        if document is not MISSING:
+            yield from iter_pointer(document, rest)
+    elif isinstance(document, (dict, list)):
+        for item in (document.values() if isinstance(document, dict) else document):
+            yield from iter_pointer(item, rest)
+
+
+# Return True if a record has the header path, with the value of which
+# canonical is the text if it is not None
+def record_matches(record, path, canonical):
+    tokens = parse_pointer(path)
+    if ANY in tokens:
+        values = list(iter_pointer(record.extra_headers, tokens))
+    else:
+        value = record.extra_header_value(path, MISSING)
+        values = [] if value is MISSING else [value]
+
+    if canonical is None:
+        return bool(values)
+    return any(canonical_value(value) == canonical for value in values)
+
+
+# Return the index section of a single file as a dict of
+#
+#   path, size, mtime: the file and its state when indexed
+#   records: [offset, start time, end time] of records with extra headers
+#   keys: header paths to the numbers of the records they appear in
+#   values: header paths to value texts to record numbers, for paths
+#           with at most MAX_INDEXED_VALUES values
+def index_file(path):
+    stat = os.stat(path)
+    records = []
+    keys = {}
+    values = {}
+
+    with MS3File(path) as ms3file:
+        for record in ms3file:
+            if not record.length_extra_header:
+                continue
+            try:
+                document = record.extra_headers
+            except ValueError:
+                continue
+
+            number = len(records)
+            records.append([record.offset, record.start_time, record.end_time])
+
+            for key, value in flatten(document):
+                postings = keys.setdefault(key, [])
+                if not postings or postings[-1] != number:
+                    postings.append(number)
+
+                if value is MISSING:
+                    continue
+                key_values = values.setdefault(key, {})
+                if key_values is None:
+                    continue
+                postings = key_values.setdefault(canonical_value(value), [])
+                if not postings or postings[-1] != number:
+                    postings.append(number)
+                if len(key_values) > MAX_INDEXED_VALUES:
+                    values[key] = None
+
+    return {
+        'path': path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'records': records,
+        'keys': keys,
+        'values': {key: key_values for key, key_values in values.items()
+                   if key_values is not None},
+    }
+
+
+# Index files in parallel, yielding the section of each in order
+def index_files(paths, workers=None):
+    paths = list(paths)
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            yield index_file(path)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(index_file, paths, chunksize=chunksize)
+
+
+# Extra header index of the files in an archive directory, sections
+# are kept by path relative to the directory
+class HeaderIndex:
+
+    def __init__(self, root, sections=()):
+        self.root = root
+        self.sections = {section['path']: section for section in sections}
+
+    def __len__(self):
+        return sum(len(section['records']) for section in self.sections.values())
+
+    # Bring the index up to date with a list of files, indexing new and
+    # changed files and dropping missing ones.  Return True if the
+    # index changed.
+    def update(self, paths, workers=None):
+        paths = {os.path.relpath(path, self.root): path for path in paths}
+        changed = False
+
+        for relative in list(self.sections):
+            if relative not in paths:
+                del self.sections[relative]
+                changed = True
+
+        stale = []
+        for relative, path in paths.items():
+            section = self.sections.get(relative)
+            if section is not None:
+                stat = os.stat(path)
+                if (stat.st_size == section['size'] and
+                        stat.st_mtime_ns == section['mtime']):
+                    continue
+            stale.append(path)
+
+        for section in index_files(stale, workers):
+            section['path'] = os.path.relpath(section['path'], self.root)
+            self.sections[section['path']] = section
+            changed = True
+
+        return changed
+
+    # Return a Counter of header paths by the number of records they
+    # appear in
+    def keys(self):
+        counts = collections.Counter()
+        for section in self.sections.values():
+            for key, postings in section['keys'].items():
+                counts[key] += len(postings)
+        return counts
+
+    # Return (file path, record offset) of records with the header path,
+    # with value if given, and with data between starttime and endtime,
+    # ordered by file and offset
+    def select(self, path, value=MISSING, starttime=None, endtime=None):
+        tokens = parse_pointer(path)
+        key = pointer_path(index_tokens(tokens))
+        canonical = None if value is MISSING else canonical_value(value)
+        selected = []
+
+        for relative, section in sorted(self.sections.items()):
+            candidates = section['keys'].get(key)
+            if not candidates:
+                continue
+
+            verify = key != path
+            if canonical is not None:
+                key_values = section['values'].get(key)
+                if key_values is None:
+                    verify = True
+                else:
+                    candidates = key_values.get(canonical, [])
+
+            records = section['records']
+            offsets = [records[number][0] for number in candidates
+                       if (starttime is None or records[number][2] >= starttime) and
+                       (endtime is None or records[number][1] <= endtime)]
+
+            file_path = os.path.join(self.root, relative)
+            if verify and offsets:
+                with MS3File(file_path) as ms3file:
+                    offsets = [offset for offset in offsets
+                               if record_matches(ms3file.record_at(offset), path, canonical)]
+
+            selected.extend((file_path, offset) for offset in sorted(offsets))
+
+        return selected
+
+    def save(self, index_path):
+        with replace_file(index_path, 'w', encoding='utf-8') as fp:
+            json.dump({'format': HEADER_INDEX_FORMAT,
+                       'files': [self.sections[relative]
+                                 for relative in sorted(self.sections)]},
+                      fp, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, index_path, root):
+        with open(index_path, encoding='utf-8') as fp:
+            data = json.load(fp)
+        if data.get('format') != HEADER_INDEX_FORMAT:
+            raise ValueError(f'{index_path} is not a miniSEED 3 extra header index')
+        return cls(root, data['files'])
+
+
+# Return the extra header index of an archive directory, loading the
+# sidecar index file and updating it if any files changed.  An index
+# file that cannot be loaded is rebuilt.
+def load_header_index(root, pattern='*.mseed3', workers=None):
+    index_path = os.path.join(root, HEADER_INDEX_NAME)
+
+    index = None
+    if os.path.exists(index_path):
+        try:
+            index = HeaderIndex.load(index_path, root)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            pass
+    rebuild = index is None
+    if rebuild:
+        index = HeaderIndex(root)
+
+    if index.update(find_files([root], pattern), workers) or rebuild:
+        index.save(index_path)
+    return index
+
+
+# Parse a value given on the command line as JSON, or as a string if it
+# is not valid JSON
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Find miniSEED V3 records by extra headers using an archive index.')
+
+    parser.add_argument('directory',
+                        help='Archive directory, the index is kept in it')
+    parser.add_argument('-k', '--key', dest='key', default=None,
+                        help='Select records with this header path (e.g. /FDSN/Event/Detection), '
+                             'otherwise list all header paths')
+    parser.add_argument('-v', '--value', dest='value', default=None,
+                        help='Select records where the header has this value, JSON or a string')
+    parser.add_argument('-s', '--starttime', dest='starttime', default=None,
+                        help='Select records with data after this time (e.g. 2022-06-05T20:32:38Z)')
+    parser.add_argument('-e', '--endtime', dest='endtime', default=None,
+                        help='Select records with data before this time')
+    parser.add_argument('-p', '--pattern', dest='pattern', default='*.mseed3',
+                        help='File name pattern in the directory (default "*.mseed3")')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Number of worker processes (default is number of CPUs)')
+
+    args = parser.parse_args()
+
+    index = load_header_index(args.directory, args.pattern, args.jobs)
+
+    if args.key is None:
+        for key, count in sorted(index.keys().items()):
+            print(f'{key} {count}')
+        return
+
+    value = MISSING if args.value is None else parse_value(args.value)
+    starttime = isotime_to_nstime(args.starttime) if args.starttime else None
+    endtime = isotime_to_nstime(args.endtime) if args.endtime else None
+
+    selected = index.select(args.key, value, starttime, endtime)
+    for path, group in itertools.groupby(selected, key=lambda item: item[0]):
+        with MS3File(path) as ms3file:
+            for _, offset in group:
+                record = ms3file.record_at(offset)
+                print(f'{path} {offset} {record.identifier} '
+                      f'{nstime_to_isotime(record.start_time)}')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
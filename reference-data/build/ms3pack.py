@@ -0,0 +1,231 @@
+#
+# Pack a continuous series of samples into miniSEED V3 records of a
+# target length, choosing the most compact encoding for each record.
+#
+# The encoding is chosen from statistics of the whole series computed
+# once with array operations: the range of the samples in each record
+# decides whether 16-bit integers or 32-bit floats are lossless, and the
+# bit width of each sample difference gives an estimate of the space it
+# takes in Steim-1 and Steim-2 words.  Only the chosen encoding is run.
+
+import numpy as np
+
+import steim
+from ms3record import (MS3Record, FIXED_HEADER_LENGTH, ENCODING_INT16,
+                       ENCODING_INT32, ENCODING_FLOAT32, ENCODING_FLOAT64,
+                       ENCODING_STEIM1, ENCODING_STEIM2, SAMPLE_SIZES,
+                       STEIM_FRAME_LENGTH, nstime_to_fields,
+                       sample_interval_ns)
+
+DEFAULT_RECORD_LENGTH = 4096
+
+INTEGER_ENCODINGS = (ENCODING_INT16, ENCODING_INT32, ENCODING_STEIM1, ENCODING_STEIM2)
+FLOAT_ENCODINGS = (ENCODING_FLOAT32, ENCODING_FLOAT64)
+
+STEIM_ENCODERS = {
+    ENCODING_STEIM1: steim.encode_steim1,
+    ENCODING_STEIM2: steim.encode_steim2,
+}
+
+# Little-endian payload types of fixed width encodings
+PAYLOAD_TYPES = {
+    ENCODING_INT16: np.dtype('<i2'),
+    ENCODING_INT32: np.dtype('<i4'),
+    ENCODING_FLOAT32: np.dtype('<f4'),
+    ENCODING_FLOAT64: np.dtype('<f8'),
+}
+
+INT16_RANGE = (-2**15, 2**15 - 1)
+
+# Bytes of a Steim data word taken by a difference, by the narrowest
+# class width that holds it (see steim.width_levels).  Differences too
+# wide for any class cannot be encoded.
+STEIM_WIDTHS = {
+    ENCODING_STEIM1: [8, 16, 32],
+    ENCODING_STEIM2: [4, 5, 6, 8, 10, 15, 30],
+}
+STEIM_COSTS = {
+    ENCODING_STEIM1: [1, 2, 4],
+    ENCODING_STEIM2: [4 / 7, 4 / 6, 4 / 5, 1, 4 / 3, 2, 4],
+}
+
+# Data word bytes per frame and in the first frame of a payload
+FRAME_DATA_BYTES = steim.FRAME_DATA_WORDS * 4
+FIRST_FRAME_DATA_BYTES = steim.FIRST_FRAME_WORDS * 4
+
+
+# Return the cumulative estimated Steim data word bytes of differences,
+# starting with 0, and the positions of differences that cannot be
+# encoded.  These cost more than limit so no run including them fits.
+def steim_costs(differences, encoding, limit):
+    levels = steim.width_levels(differences, STEIM_WIDTHS[encoding])
+    costs = np.append(STEIM_COSTS[encoding], limit + 1)[levels]
+    wide = np.flatnonzero(levels == len(STEIM_WIDTHS[encoding]))
+    return np.concatenate(([0.0], np.cumsum(costs))), wide
+
+
+# Return the estimated payload length of count Steim encoded
+# differences with data word bytes of data_bytes
+def steim_length(data_bytes, count):
+    if count == 0:
+        return 0
+    frames = 1 + max(0, -(-(data_bytes - FIRST_FRAME_DATA_BYTES) // FRAME_DATA_BYTES))
+    return int(frames) * STEIM_FRAME_LENGTH
+
+
+# Per-series statistics used to choose the encoding of each record
+class SeriesStatistics:
+
+    def __init__(self, samples, encodings, capacity):
+        self.samples = samples
+        self.encodings = encodings
+        self.capacity = capacity
+        self.max_frames = capacity // STEIM_FRAME_LENGTH
+        self.steim_bytes = max(self.max_frames * FRAME_DATA_BYTES - 8, 0)
+        self.differences = None
+        self.cumulative = {}
+        self.wide = {}
+        self.exact_float32 = None
+
+        if samples.dtype.kind == 'f':
+            single = samples.astype(np.float32)
+            self.exact_float32 = (single == samples) | np.isnan(samples)
+        elif self.max_frames and any(encoding in STEIM_ENCODERS for encoding in encodings):
+            # Differences wrap as 32-bit integers as they do in the encoder
+            self.differences = np.empty(len(samples), dtype=np.int32)
+            self.differences[0] = 0
+            np.subtract(samples[1:], samples[:-1], out=self.differences[1:])
+            for encoding in STEIM_ENCODERS:
+                if encoding in encodings:
+                    self.cumulative[encoding], self.wide[encoding] = steim_costs(
+                        self.differences, encoding, self.steim_bytes)
+
+    # Return the number of samples from start that fit in a record of
+    # an encoding and the estimated payload length
+    def estimate(self, encoding, start):
+        remaining = len(self.samples) - start
+
+        if encoding in SAMPLE_SIZES:
+            count = min(self.capacity // SAMPLE_SIZES[encoding], remaining)
+            window = slice(start, start + count)
+            if encoding == ENCODING_INT16:
+                if count and (self.samples[window].min() < INT16_RANGE[0] or
+                              self.samples[window].max() > INT16_RANGE[1]):
+                    return 0, 0
+            elif encoding == ENCODING_FLOAT32 and self.samples.dtype != np.float32:
+                if not self.exact_float32[window].all():
+                    return 0, 0
+            return count, count * SAMPLE_SIZES[encoding]
+
+        cumulative = self.cumulative[encoding]
+        end = np.searchsorted(cumulative, cumulative[start] + self.steim_bytes, side='right') - 1
+        count = int(end) - start
+        return count, steim_length(cumulative[end] - cumulative[start], count)
+
+    # Choose the encoding of the record starting at start.  A record
+    # holding the most samples is preferred, for the last record the
+    # smallest that holds all remaining samples.
+    def choose(self, start):
+        remaining = len(self.samples) - start
+        estimates = [(encoding, *self.estimate(encoding, start))
+                     for encoding in self.encodings]
+        complete = [(length, encoding) for encoding, count, length in estimates
+                    if count == remaining]
+        if complete:
+            return min(complete)[1]
+        encoding, count, _ = max(estimates, key=lambda estimate: estimate[1])
+        if count == 0:
+            raise ValueError(f'No encoding fits sample {start} in a record')
+        return encoding
+
+
+# Return the payload and number of samples of a record of an encoding
+# starting at start
+def encode_record(statistics, encoding, start):
+    samples = statistics.samples
+
+    if encoding in PAYLOAD_TYPES:
+        count, _ = statistics.estimate(encoding, start)
+        return samples[start:start + count].astype(PAYLOAD_TYPES[encoding]).tobytes(), count
+
+    # The estimate ignores how differences group into words, encode a
+    # margin beyond it and widen if the frames are not filled.  Samples
+    # are only passed up to the next difference that cannot be encoded.
+    encoder = STEIM_ENCODERS[encoding]
+    diff0 = int(statistics.differences[start])
+    estimate, _ = statistics.estimate(encoding, start)
+    wide = statistics.wide[encoding]
+    position = np.searchsorted(wide, start, side='right')
+    limit = int(wide[position]) if position < len(wide) else len(samples)
+    span = estimate + estimate // 4 + 16
+    while True:
+        end = min(start + span, limit)
+        payload, count = encoder(samples[start:end], statistics.max_frames, diff0)
+        if start + count < end or end == limit:
+            return payload, count
+        span *= 2
+
+
+# Pack samples into records of at most record_length bytes, yielding
+# MS3Record tuples.  start_time is in nanoseconds since the epoch.
+# Integer samples are encoded as 16 or 32-bit integers or with Steim-1
+# or Steim-2 compression, float samples as 32-bit floats where that is
+# lossless and 64-bit floats otherwise.  encodings limits the choice.
+def pack_samples(identifier, start_time, sample_rate_period, samples,
+                 record_length=DEFAULT_RECORD_LENGTH, encodings=None,
+                 pub_version=1, flags=0, extra_header=b''):
+    samples = np.asarray(samples)
+    if samples.ndim != 1:
+        raise ValueError('Samples must be a one dimensional array')
+
+    if samples.dtype.kind in 'iu':
+        if len(samples) and (samples.min() < -2**31 or samples.max() >= 2**31):
+            raise ValueError('Integer samples must fit in 32 bits')
+        samples = samples.astype(np.int32, copy=False)
+        available = INTEGER_ENCODINGS
+    elif samples.dtype.kind == 'f':
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float64, copy=False)
+        available = FLOAT_ENCODINGS
+    else:
+        raise ValueError(f'Cannot pack samples of type {samples.dtype}')
+
+    if encodings is None:
+        encodings = available
+    else:
+        encodings = tuple(encoding for encoding in encodings if encoding in available)
+        if not encodings:
+            raise ValueError(f'No requested encoding applies to samples of type {samples.dtype}')
+
+    if isinstance(identifier, str):
+        identifier = identifier.encode('ascii')
+    capacity = record_length - FIXED_HEADER_LENGTH - len(identifier) - len(extra_header)
+    if capacity <= 0:
+        raise ValueError(f'Record length {record_length} leaves no room for data')
+
+    # Steim payloads need at least one frame
+    if capacity < STEIM_FRAME_LENGTH:
+        encodings = tuple(encoding for encoding in encodings if encoding not in STEIM_ENCODERS)
+        if not encodings:
+            raise ValueError(f'Record length {record_length} leaves no room for a Steim frame')
+
+    if len(samples) == 0:
+        return
+
+    statistics = SeriesStatistics(samples, encodings, capacity)
+
+    start = 0
+    while start < len(samples):
+        encoding = statistics.choose(start)
+        payload, count = encode_record(statistics, encoding, start)
+
+        yield MS3Record(identifier,
+                        *nstime_to_fields(start_time + sample_interval_ns(sample_rate_period, start)),
+                        encoding=encoding,
+                        sample_rate_period=sample_rate_period,
+                        number_samples=count,
+                        pub_version=pub_version,
+                        flags=flags,
+                        extra_header=extra_header,
+                        payload=payload)
+        start += count
@@ -0,0 +1,91 @@
+#
+# Decode miniSEED V3 data payloads (field 15) into NumPy arrays.
+
+import numpy as np
+
+import steim
+from ms3record import (ENCODING_TEXT, ENCODING_INT16, ENCODING_INT32,
+                       ENCODING_FLOAT32, ENCODING_FLOAT64, ENCODING_STEIM1,
+                       ENCODING_STEIM2)
+
+# NumPy types of fixed width encodings, little-endian
+SAMPLE_TYPES = {
+    ENCODING_INT16: np.dtype('<i2'),
+    ENCODING_INT32: np.dtype('<i4'),
+    ENCODING_FLOAT32: np.dtype('<f4'),
+    ENCODING_FLOAT64: np.dtype('<f8'),
+}
+
+# Type of decoded samples by encoding
+DECODED_TYPES = {
+    ENCODING_INT16: np.dtype(np.int16),
+    ENCODING_INT32: np.dtype(np.int32),
+    ENCODING_FLOAT32: np.dtype(np.float32),
+    ENCODING_FLOAT64: np.dtype(np.float64),
+    ENCODING_STEIM1: np.dtype(np.int32),
+    ENCODING_STEIM2: np.dtype(np.int32),
+}
+
+
+STEIM_DECODERS = {
+    ENCODING_STEIM1: steim.decode_steim1,
+    ENCODING_STEIM2: steim.decode_steim2,
+}
+
+STEIM_BATCH_DECODERS = {
+    ENCODING_STEIM1: steim.decode_steim1_many,
+    ENCODING_STEIM2: steim.decode_steim2_many,
+}
+
+
+# Decode a payload to an array of number_samples, or to a str for text.
+# Fixed width encodings are returned as read-only views of the payload
+# when it is in native byte order.  Samples are decoded into out if
+# given, an array of number_samples of any numeric type, which is
+# returned.
+def decode_payload(payload, encoding, number_samples, out=None):
+    if encoding == ENCODING_TEXT:
+        return str(payload, 'utf-8')
+
+    if encoding in SAMPLE_TYPES:
+        dtype = SAMPLE_TYPES[encoding]
+        if number_samples * dtype.itemsize > len(payload):
+            raise ValueError(f'Payload of {len(payload)} bytes is too short '
+                             f'for {number_samples} samples')
+        samples = np.frombuffer(payload, dtype=dtype, count=number_samples)
+        if out is None:
+            return samples.astype(DECODED_TYPES[encoding], copy=False)
+        out[...] = samples
+        return out
+
+    if encoding in STEIM_DECODERS:
+        if out is None or out.dtype == np.int32:
+            return STEIM_DECODERS[encoding](payload, number_samples, out=out)
+        out[...] = STEIM_DECODERS[encoding](payload, number_samples)
+        return out
+
+    raise ValueError(f'Cannot decode payload encoding {encoding}')
+
+
+# Decode payloads of one encoding, each of the number of samples at the
+# same position in number_samples, into one array of the decoded type,
+# or into out, an array of the total number of samples.  Steim payloads
+# are decoded together in one pass.
+def decode_payloads(payloads, encoding, number_samples, out=None):
+    if encoding not in DECODED_TYPES:
+        raise ValueError(f'Cannot decode payload encoding {encoding}')
+
+    if encoding in STEIM_BATCH_DECODERS:
+        if out is None or out.dtype == np.int32:
+            return STEIM_BATCH_DECODERS[encoding](payloads, number_samples, out=out)
+        out[...] = STEIM_BATCH_DECODERS[encoding](payloads, number_samples)
+        return out
+
+    if out is None:
+        out = np.empty(sum(number_samples), dtype=DECODED_TYPES[encoding])
+    position = 0
+    for payload, count in zip(payloads, number_samples):
+        decode_payload(payload, encoding, count, out=out[position:position + count])
+        position += count
+    return out
+
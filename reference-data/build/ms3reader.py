@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+#
+# Read miniSEED V3 records from memory-mapped files, verify their CRCs
+# and maintain a sidecar index for time window and channel queries.
+#
+# Records are framed using the identifier, extra header and payload
+# lengths (fields 10, 11 and 12) and returned as lightweight views
+# that slice the mapping without copying.  Extra headers are only
+# decoded from JSON when they are first accessed.
+
+import os
+import sys
+import json
+import mmap
+import bisect
+import struct
+import fnmatch
+import tempfile
+import argparse
+import functools
+import contextlib
+import collections
+
+from ms3crc import record_crc
+from ms3record import (FIXED_HEADER, FIXED_HEADER_LENGTH, CRC_FIELD,
+                       CRC_OFFSET, fields_to_nstime, sample_interval_ns,
+                       nstime_to_isotime, isotime_to_nstime)
+
+# Fields 10, 11 and 12, the lengths of the variable sections
+LENGTHS = struct.Struct('<BHL')
+LENGTHS_OFFSET = 33
+
+# Marks a path missing from the extra headers in lookup caches
+MISSING = object()
+
+
+# Split a JSON pointer (RFC 6901), e.g. /FDSN/Time/Quality, into its
+# reference tokens.  The empty pointer refers to the whole document.
+@functools.lru_cache(maxsize=1024)
+def parse_pointer(pointer):
+    if pointer == '':
+        return ()
+    if not pointer.startswith('/'):
+        raise ValueError(f'JSON pointer {pointer!r} does not start with /')
+    return tuple(token.replace('~1', '/').replace('~0', '~')
+                 for token in pointer[1:].split('/'))
+
+
+# Return the value at the reference tokens of a JSON pointer in a
+# decoded document, or MISSING
+def resolve_pointer(document, tokens):
+    for token in tokens:
+        if isinstance(document, dict):
+            document = document.get(token, MISSING)
+        elif isinstance(document, list) and token.isdigit():
+            index = int(token)
+            document = document[index] if index < len(document) else MISSING
+        else:
+            return MISSING
+        if document is MISSING:
+            break
+    return document
+
+
+# A view of a single record within a larger buffer.  The fixed header
+# is unpacked once, the variable length sections are memoryview slices
+# of the underlying buffer.  Decoded extra headers and the results of
+# path lookups are kept with the view.
+class RecordView:
+
+    __slots__ = ('buffer', 'offset', 'header', 'decoded', 'lookups')
+
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+        self.header = FIXED_HEADER.unpack_from(buffer, offset)
+        self.decoded = None
+        self.lookups = None
+
+    indicator = property(lambda self: self.header[0])
+    format_version = property(lambda self: self.header[1])
+    flags = property(lambda self: self.header[2])
+    nanosecond = property(lambda self: self.header[3])
+    year = property(lambda self: self.header[4])
+    day = property(lambda self: self.header[5])
+    hour = property(lambda self: self.header[6])
+    minute = property(lambda self: self.header[7])
+    second = property(lambda self: self.header[8])
+    encoding = property(lambda self: self.header[9])
+    sample_rate_period = property(lambda self: self.header[10])
+    number_samples = property(lambda self: self.header[11])
+    crc = property(lambda self: self.header[12])
+    pub_version = property(lambda self: self.header[13])
+    length_identifier = property(lambda self: self.header[14])
+    length_extra_header = property(lambda self: self.header[15])
+    length_payload = property(lambda self: self.header[16])
+
+    @property
+    def length(self):
+        header = self.header
+        return FIXED_HEADER_LENGTH + header[14] + header[15] + header[16]
+
+    @property
+    def record(self):
+        return self.buffer[self.offset:self.offset + self.length]
+
+    @property
+    def identifier(self):
+        start = self.offset + FIXED_HEADER_LENGTH
+        return str(self.buffer[start:start + self.header[14]], 'ascii')
+
+    @property
+    def extra_header(self):
+        start = self.offset + FIXED_HEADER_LENGTH + self.header[14]
+        return self.buffer[start:start + self.header[15]]
+
+    # Extra headers decoded from JSON on first access, an empty dict if
+    # there are none
+    @property
+    def extra_headers(self):
+        if self.decoded is None:
+            self.decoded = (json.loads(bytes(self.extra_header))
+                            if self.header[15] else {})
+        return self.decoded
+
+    # Return the extra header value at a JSON pointer path, e.g.
+    # /FDSN/Time/Quality, or default if it is not present
+    def extra_header_value(self, path, default=None):
+        lookups = self.lookups
+        if lookups is None:
+            lookups = self.lookups = {}
+        if path not in lookups:
+            lookups[path] = self.lookup(parse_pointer(path))
+        value = lookups[path]
+        return default if value is MISSING else value
+
+    # Return the extra header value at the tokens of a JSON pointer or
+    # MISSING.  Object member names that do not appear in the raw JSON
+    # rule out a match without decoding it, unless it has escapes.
+    def lookup(self, tokens):
+        if self.decoded is None:
+            raw = bytes(self.extra_header)
+            if not raw:
+                return MISSING
+            if b'\\' not in raw:
+                for token in tokens:
+                    if (not token.isdigit() and
+                            json.dumps(token, ensure_ascii=False).encode('utf-8') not in raw):
+                        return MISSING
+        return resolve_pointer(self.extra_headers, tokens)
+
+    @property
+    def payload(self):
+        start = (self.offset + FIXED_HEADER_LENGTH +
+                 self.header[14] + self.header[15])
+        return self.buffer[start:start + self.header[16]]
+
+    # True if the CRC (field 8) matches the record contents
+    @property
+    def crc_valid(self):
+        return record_crc(self.record) == self.header[12]
+
+    # Start time in integer nanoseconds since the epoch
+    @property
+    def start_time(self):
+        header = self.header
+        return fields_to_nstime(header[4], header[5], header[6],
+                                header[7], header[8], header[3])
+
+    # Time of the last sample in integer nanoseconds since the epoch
+    @property
+    def end_time(self):
+        count = self.header[11]
+        return (self.start_time +
+                sample_interval_ns(self.header[10], max(count - 1, 0)))
+
+
+# Return the length of the record at offset in buffer, validating that
+# it starts with a record indicator and fits in the buffer
+def frame_record(buffer, offset, end):
+    if end - offset < FIXED_HEADER_LENGTH:
+        raise ValueError(f'Truncated record header at offset {offset}')
+    if buffer[offset:offset + 2] != b'MS':
+        raise ValueError(f'Record indicator not found at offset {offset}')
+
+    (length_identifier,
+     length_extra_header,
+     length_payload) = LENGTHS.unpack_from(buffer, offset + LENGTHS_OFFSET)
+    length = (FIXED_HEADER_LENGTH + length_identifier +
+              length_extra_header + length_payload)
+
+    if offset + length > end:
+        raise ValueError(f'Truncated record at offset {offset}')
+
+    return length
+
+
+# Iterate over the offsets and lengths of all records in a buffer
+def iter_frames(buffer):
+    end = len(buffer)
+    offset = 0
+    while offset < end:
+        length = frame_record(buffer, offset, end)
+        yield offset, length
+        offset += length
+
+
+# Iterate over all records in a buffer as RecordView objects
+def iter_records(buffer):
+    if not isinstance(buffer, memoryview):
+        buffer = memoryview(buffer)
+    for offset, _ in iter_frames(buffer):
+        yield RecordView(buffer, offset)
+
+
+# Verify the CRC of every record in a buffer, return the offsets of
+# records that fail
+def verify_records(buffer):
+    buffer = memoryview(buffer)
+    failed = []
+    for offset, length in iter_frames(buffer):
+        crc = CRC_FIELD.unpack_from(buffer, offset + CRC_OFFSET)[0]
+        if record_crc(buffer[offset:offset + length]) != crc:
+            failed.append(offset)
+    return failed
+
+
+# A memory-mapped file of concatenated records.  Record views share the
+# file's memoryview and cannot be used once the file is closed.  If
+# slices of the mapping are still referenced when the file is closed,
+# the mapping itself is released with the last of them.
+class MS3File:
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, 'rb')
+        if os.fstat(self.fp.fileno()).st_size > 0:
+            self.mmap = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mmap)
+        else:
+            self.mmap = None
+            self.buffer = memoryview(b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter_records(self.buffer)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def record_at(self, offset):
+        frame_record(self.buffer, offset, len(self.buffer))
+        return RecordView(self.buffer, offset)
+
+    # Return the offsets of records that fail CRC verification
+    def verify(self):
+        return verify_records(self.buffer)
+
+    # Return views of the records at the offsets of index entries
+    def records(self, entries):
+        return [self.record_at(entry.offset) for entry in entries]
+
+    def close(self):
+        self.buffer.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass
+        self.fp.close()
+
+
+# Expand directories to the files within them matching pattern
+def find_files(paths, pattern):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                for name in sorted(fnmatch.filter(files, pattern)):
+                    yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+# Open a temporary file in the directory of path for writing, which
+# replaces path only when it has been written completely, so readers
+# never see a partly written file
+@contextlib.contextmanager
+def replace_file(path, mode='w', **kwargs):
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+    try:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        with os.fdopen(descriptor, mode, **kwargs) as fp:
+            yield fp
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+# Sidecar index file layout, little-endian:
+#
+# header: magic, indexed file size, indexed file mtime (ns),
+#         number of identifiers, number of entries
+# identifiers: length (uint8) followed by the ASCII identifier
+# entries: offset, identifier number, start time (ns), sample rate/period,
+#          number of samples
+INDEX_MAGIC = b'MS3INDX1'
+INDEX_HEADER = struct.Struct('<8sQqLQ')
+INDEX_ENTRY = struct.Struct('<QLqdL')
+INDEX_SUFFIX = '.idx'
+
+IndexEntry = collections.namedtuple('IndexEntry', [
+    'offset',
+    'identifier',
+    'start_time',
+    'sample_rate_period',
+    'number_samples',
+])
+
+
+# Index of records in a file by source identifier and start time.
+# Entries for each identifier are sorted by start time, so time window
+# queries are a binary search per identifier.
+class MS3Index:
+
+    def __init__(self, entries, file_size=0, file_mtime=0):
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.channels = {}
+
+        for entry in sorted(entries, key=lambda e: (e.start_time, e.offset)):
+            self.channels.setdefault(entry.identifier, []).append(entry)
+
+        # Start times for bisection and the longest record duration,
+        # which bounds how far before a window an overlapping record
+        # may start
+        self.start_times = {}
+        self.max_duration = {}
+        for identifier, channel in self.channels.items():
+            self.start_times[identifier] = [e.start_time for e in channel]
+            self.max_duration[identifier] = max(entry_duration(e)
+                                                for e in channel)
+
+    def __len__(self):
+        return sum(len(channel) for channel in self.channels.values())
+
+    def identifiers(self, pattern=None):
+        if pattern is None:
+            return sorted(self.channels)
+        if pattern in self.channels:
+            return [pattern]
+        return sorted(fnmatch.filter(self.channels, pattern))
+
+    # Return entries matching the identifier (glob pattern allowed)
+    # with data between starttime and endtime, ordered by file offset
+    def select(self, identifier=None, starttime=None, endtime=None):
+        selected = []
+
+        for channel_id in self.identifiers(identifier):
+            channel = self.channels[channel_id]
+            start_times = self.start_times[channel_id]
+
+            first = 0
+            if starttime is not None:
+                first = bisect.bisect_left(
+                    start_times, starttime - self.max_duration[channel_id])
+            last = len(channel)
+            if endtime is not None:
+                last = bisect.bisect_right(start_times, endtime)
+
+            for entry in channel[first:last]:
+                if (starttime is None or
+                        entry.start_time + entry_duration(entry) >= starttime):
+                    selected.append(entry)
+
+        selected.sort(key=lambda entry: entry.offset)
+        return selected
+
+    # Return True if the index was built from the current version of path
+    def is_current(self, path):
+        stat = os.stat(path)
+        return (stat.st_size == self.file_size and
+                stat.st_mtime_ns == self.file_mtime)
+
+    def save(self, index_path):
+        identifiers = sorted(self.channels)
+        numbers = {identifier: i for i, identifier in enumerate(identifiers)}
+
+        with replace_file(index_path, 'wb') as fp:
+            fp.write(INDEX_HEADER.pack(INDEX_MAGIC, self.file_size,
+                                       self.file_mtime, len(identifiers),
+                                       len(self)))
+            for identifier in identifiers:
+                encoded = identifier.encode('ascii')
+                fp.write(bytes([len(encoded)]) + encoded)
+
+            entries = bytearray(INDEX_ENTRY.size * len(self))
+            position = 0
+            for identifier in identifiers:
+                for entry in self.channels[identifier]:
+                    INDEX_ENTRY.pack_into(entries, position, entry.offset,
+                                          numbers[identifier],
+                                          entry.start_time,
+                                          entry.sample_rate_period,
+                                          entry.number_samples)
+                    position += INDEX_ENTRY.size
+            fp.write(entries)
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, 'rb') as fp:
+            data = fp.read()
+
+        (magic, file_size, file_mtime,
+         identifier_count, entry_count) = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'{index_path} is not a miniSEED 3 index')
+
+        identifiers = []
+        position = INDEX_HEADER.size
+        for _ in range(identifier_count):
+            length = data[position]
+            identifiers.append(str(data[position + 1:position + 1 + length],
+                                   'ascii'))
+            position += 1 + length
+
+        entries_end = position + entry_count * INDEX_ENTRY.size
+        if entries_end != len(data):
+            raise ValueError(f'{index_path} is truncated or corrupt')
+        entries = [IndexEntry(offset, identifiers[number], start_time,
+                              sample_rate_period, number_samples)
+                   for (offset, number, start_time,
+                        sample_rate_period, number_samples)
+                   in INDEX_ENTRY.iter_unpack(data[position:entries_end])]
+
+        return cls(entries, file_size, file_mtime)
+
+
+# Return the time covered by an index entry from the first to the
+# last sample, in nanoseconds
+def entry_duration(entry):
+    return sample_interval_ns(entry.sample_rate_period,
+                              max(entry.number_samples - 1, 0))
+
+
+# Build an index of all records in a file
+def build_index(path):
+    stat = os.stat(path)
+    with MS3File(path) as ms3file:
+        entries = [IndexEntry(record.offset, record.identifier,
+                              record.start_time, record.sample_rate_period,
+                              record.number_samples)
+                   for record in ms3file]
+    return MS3Index(entries, stat.st_size, stat.st_mtime_ns)
+
+
+# Return the index for path, loading the sidecar index file if it is
+# current and otherwise building and saving it
+def load_index(path, index_path=None):
+    if index_path is None:
+        index_path = path + INDEX_SUFFIX
+
+    if os.path.exists(index_path):
+        try:
+            index = MS3Index.load(index_path)
+        except (struct.error, ValueError, IndexError):
+            index = None  # Corrupt, rebuilt below
+        if index is not None and index.is_current(path):
+            return index
+
+    index = build_index(path)
+    index.save(index_path)
+    return index
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='List miniSEED V3 records, optionally selected using a sidecar index.')
+
+    parser.add_argument('files', nargs='+',
+                        help='miniSEED V3 files to read')
+    parser.add_argument('-i', '--identifier', dest='identifier', default=None,
+                        help='Select source identifier, glob patterns allowed')
+    parser.add_argument('-s', '--starttime', dest='starttime', default=None,
+                        help='Select records with data after this time (e.g. 2022-06-05T20:32:38Z)')
+    parser.add_argument('-e', '--endtime', dest='endtime', default=None,
+                        help='Select records with data before this time')
+    parser.add_argument('-n', '--noindex', dest='noindex', action='store_true',
+                        help='Do not create or use sidecar index files')
+    parser.add_argument('-c', '--verify', dest='verify', action='store_true',
+                        help='Verify record CRCs and list the offsets of failing records')
+
+    args = parser.parse_args()
+
+    if args.verify:
+        failures = 0
+        for path in args.files:
+            with MS3File(path) as ms3file:
+                failed = ms3file.verify()
+            for offset in failed:
+                print(f'{path} {offset} CRC mismatch')
+            failures += len(failed)
+        if failures:
+            exit(1)
+        return
+
+    starttime = isotime_to_nstime(args.starttime) if args.starttime else None
+    endtime = isotime_to_nstime(args.endtime) if args.endtime else None
+
+    for path in args.files:
+        if args.noindex:
+            entries = build_index(path).select(args.identifier, starttime, endtime)
+        else:
+            entries = load_index(path).select(args.identifier, starttime, endtime)
+
+        for entry in entries:
+            print(f'{path} {entry.offset} {entry.identifier} '
+                  f'{nstime_to_isotime(entry.start_time)} '
+                  f'{entry.sample_rate_period:g} {entry.number_samples}')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
@@ -0,0 +1,305 @@
+#
+# miniSEED V3 record layout, time conversions and a bulk record writer.
+#
+# Records are packed directly into a preallocated output buffer: the
+# fixed header is written with a precompiled struct, the identifier,
+# extra headers and payload are copied into place and the CRC is
+# patched in after it has been calculated over the packed record.
+
+import struct
+import datetime
+import functools
+import collections
+
+from ms3crc import crc32c, CRC_OFFSET
+
+
+# miniSEED 3 Fixed Section of Data Header
+# 40 bytes, plus length of identifier, plus length of extra headers
+#
+# #  FIELD                   TYPE       OFFSET
+# 1  record indicator        char[2]       0
+# 2  format version          uint8_t       2
+# 3  flags                   uint8_t       3
+# 4a nanosecond              uint32_t      4
+# 4b year                    uint16_t      8
+# 4c day                     uint16_t     10
+# 4d hour                    uint8_t      12
+# 4e min                     uint8_t      13
+# 4f sec                     uint8_t      14
+# 5  data encoding           uint8_t      15
+# 6  sample rate/period      float64      16
+# 7  number of samples       uint32_t     24
+# 8  CRC of record           uint32_t     28
+# 9  publication version     uint8_t      32
+# 10 length of identifer     uint8_t      33
+# 11 length of extra headers uint16_t     34
+# 12 length of data payload  uint32_t     36
+# 13 source identifier       char         40
+# 14 extra headers           char         40 + field 10
+# 15 data payload            encoded      40 + field 10 + field 11
+
+# Python struct codes:
+# < = little endian
+# s = char[]
+# B = unsigned char (8 bits)
+# H = unsigned short (16 bits)
+# L = unsigned long (32 bits)
+# d = double (64 bits)
+
+FIXED_HEADER = struct.Struct('<2sBBLHHBBBBdLLBBHL')
+FIXED_HEADER_LENGTH = FIXED_HEADER.size
+CRC_FIELD = struct.Struct('<L')
+FORMAT_VERSION = 3
+
+# Data payload encodings (field 5), see data-encodings.rst
+ENCODING_TEXT = 0
+ENCODING_INT16 = 1
+ENCODING_INT32 = 3
+ENCODING_FLOAT32 = 4
+ENCODING_FLOAT64 = 5
+ENCODING_STEIM1 = 10
+ENCODING_STEIM2 = 11
+ENCODING_STEIM3 = 19
+ENCODING_OPAQUE = 100
+
+VALID_ENCODINGS = (0, 1, 3, 4, 5, 10, 11, 19, 100)
+
+# Bytes per sample of fixed width encodings
+SAMPLE_SIZES = {1: 2, 3: 4, 4: 4, 5: 8}
+
+# Steim encodings are a sequence of 64-byte frames
+STEIM_ENCODINGS = (10, 11, 19)
+STEIM_FRAME_LENGTH = 64
+
+# Default size of the output buffer used by RecordWriter
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+NS_PER_SECOND = 1000000000
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+# Header values and variable length fields of a single record.
+# The identifier may be str or bytes, extra_header and payload are
+# bytes-like objects and are copied into the output as-is.
+MS3Record = collections.namedtuple('MS3Record', [
+    'identifier',
+    'year',
+    'day',
+    'hour',
+    'minute',
+    'second',
+    'nanosecond',
+    'encoding',
+    'sample_rate_period',
+    'number_samples',
+    'pub_version',
+    'flags',
+    'extra_header',
+    'payload',
+])
+
+# Defaults for a header-only record, as produced by generate_miniseed3.py
+MS3Record.__new__.__defaults__ = (0, 0.0, 0, 1, 0, b'', b'')
+
+
+# Return the number of days from the epoch to January 1 of year
+@functools.lru_cache(maxsize=None)
+def year_epoch_days(year):
+    return datetime.date(year, 1, 1).toordinal() - EPOCH_ORDINAL
+
+
+# Convert record start time fields (4a-4f) to integer nanoseconds since
+# the epoch.  A leap second (second 60) maps to the following second.
+def fields_to_nstime(year, day, hour, minute, second, nanosecond):
+    days = year_epoch_days(year) + day - 1
+    return ((days * 86400 + hour * 3600 + minute * 60 + second) *
+            NS_PER_SECOND + nanosecond)
+
+
+# Convert integer nanoseconds since the epoch to record start time
+# fields, return (year, day, hour, minute, second, nanosecond)
+def nstime_to_fields(nstime):
+    seconds, nanosecond = divmod(nstime, NS_PER_SECOND)
+    days, seconds = divmod(seconds, 86400)
+    date = datetime.date.fromordinal(EPOCH_ORDINAL + days)
+    day = date.toordinal() - EPOCH_ORDINAL - year_epoch_days(date.year) + 1
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    return (date.year, day, hour, minute, second, nanosecond)
+
+
+# Format integer nanoseconds since the epoch as an ISO 8601 string
+# with nanosecond resolution, e.g. 2022-06-05T20:32:38.123456789Z
+def nstime_to_isotime(nstime):
+    seconds, nanosecond = divmod(nstime, NS_PER_SECOND)
+    days, seconds = divmod(seconds, 86400)
+    date = datetime.date.fromordinal(EPOCH_ORDINAL + days)
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    return (f'{date.year:04d}-{date.month:02d}-{date.day:02d}'
+            f'T{hour:02d}:{minute:02d}:{second:02d}.{nanosecond:09d}Z')
+
+
+# Parse an ISO 8601 time string, e.g. 2022-06-05T20:32:38.123456789Z,
+# to integer nanoseconds since the epoch.  The fractional seconds and
+# trailing Z are optional, a date alone is midnight of that day.
+def isotime_to_nstime(isotime):
+    isotime = isotime.rstrip('Z')
+    date, _, time = isotime.partition('T')
+    year, month, day = (int(value) for value in date.split('-'))
+    seconds, _, fraction = time.partition('.')
+    fields = [int(value) for value in seconds.split(':')] if seconds else []
+    hour, minute, second = (fields + [0, 0, 0])[:3]
+    days = datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+    nanosecond = int(fraction.ljust(9, '0')[:9]) if fraction else 0
+    return ((days * 86400 + hour * 3600 + minute * 60 + second) *
+            NS_PER_SECOND + nanosecond)
+
+
+# Return the duration in nanoseconds of count sample periods for a
+# sample rate/period value (field 6).  Positive values are a rate in
+# samples per second, negative values are a period in seconds.  The
+# exact value of the float is used in integer arithmetic, rounded half
+# to even as round() does, so offsets of any number of samples from a
+# start time do not drift.
+def sample_interval_ns(sample_rate_period, count=1):
+    if sample_rate_period > 0.0:
+        denominator, numerator = sample_rate_period.as_integer_ratio()
+        numerator *= count * NS_PER_SECOND
+    elif sample_rate_period < 0.0:
+        numerator, denominator = (-sample_rate_period).as_integer_ratio()
+        numerator *= count * NS_PER_SECOND
+    else:
+        return 0
+
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient & 1):
+        quotient += 1
+    return quotient
+
+
+# Return the identifier of a record as bytes
+def identifier_bytes(record):
+    identifier = record.identifier
+    if isinstance(identifier, str):
+        identifier = identifier.encode('ascii')
+    return identifier
+
+
+# Return the total length of a record in bytes
+def record_length(record):
+    return (FIXED_HEADER_LENGTH + len(identifier_bytes(record)) +
+            len(record.extra_header) + len(record.payload))
+
+
+# Pack a record into view, a writable memoryview, at offset, calculate
+# the CRC over the packed bytes and patch it in place.  The view must be
+# large enough to hold the record.  Return the offset following the
+# record.
+def pack_record(view, offset, record):
+    identifier = identifier_bytes(record)
+    extra_header = record.extra_header
+    payload = record.payload
+
+    FIXED_HEADER.pack_into(view, offset,
+                           b'MS',
+                           FORMAT_VERSION,
+                           record.flags,
+                           record.nanosecond,
+                           record.year,
+                           record.day,
+                           record.hour,
+                           record.minute,
+                           record.second,
+                           record.encoding,
+                           record.sample_rate_period,
+                           record.number_samples,
+                           0, # Initial CRC is 0
+                           record.pub_version,
+                           len(identifier),
+                           len(extra_header),
+                           len(payload))
+
+    position = offset + FIXED_HEADER_LENGTH
+    end = position + len(identifier)
+    view[position:end] = identifier
+    position, end = end, end + len(extra_header)
+    view[position:end] = extra_header
+    position, end = end, end + len(payload)
+    view[position:end] = payload
+
+    # Calculate CRC32C of record and replace the zero CRC
+    CRC_FIELD.pack_into(view, offset + CRC_OFFSET,
+                        crc32c(view[offset:end]))
+
+    return end
+
+
+# Pack a sequence of records into a single new bytearray
+def pack_records(records):
+    records = list(records)
+    buffer = bytearray(sum(record_length(record) for record in records))
+
+    offset = 0
+    with memoryview(buffer) as view:
+        for record in records:
+            offset = pack_record(view, offset, record)
+
+    return buffer
+
+
+# Write records to a binary file object, see RecordWriter.
+# Return the number of records written.
+def write_records(fp, records, buffer_size=DEFAULT_BUFFER_SIZE):
+    with RecordWriter(fp, buffer_size) as writer:
+        return writer.write_records(records)
+
+
+# Buffered record writer.  Records are packed into a single reusable
+# output buffer that is written to the file object when full, so no
+# per-record byte strings are created.  Records are packed through a
+# single view of the buffer, which is released when the buffer grows
+# for a record larger than it.
+class RecordWriter:
+
+    def __init__(self, fp, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.fp = fp
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.offset = 0
+        self.record_count = 0
+        self.byte_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write(self, record):
+        length = record_length(record)
+
+        if self.offset + length > len(self.buffer):
+            self.flush()
+            if length > len(self.buffer):
+                self.view.release()
+                self.buffer = bytearray(length)
+                self.view = memoryview(self.buffer)
+
+        self.offset = pack_record(self.view, self.offset, record)
+        self.record_count += 1
+        self.byte_count += length
+
+    # Write all records from an iterable, return the number written
+    def write_records(self, records):
+        start_count = self.record_count
+        for record in records:
+            self.write(record)
+        return self.record_count - start_count
+
+    def flush(self):
+        if self.offset:
+            self.fp.write(self.view[:self.offset])
+            self.offset = 0
+        self.fp.flush()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Asyncio ingest of miniSEED V3 records from byte streams.
+#
+# Records in a stream are framed by reading the 40 byte fixed header,
+# which gives the lengths of the identifier, extra headers and payload
+# (fields 10, 11 and 12), and then exactly the rest of the record.
+# Records are read into buffers from a shared pool, verified and handed
+# to a consumer, one task per source identifier so the records of each
+# channel are consumed in order.
+#
+# Reading is paced by the consumers: a connection stops reading when
+# the queue of a channel it feeds is full, so TCP flow control pushes
+# back on the sender.  CRCs of large records, or of all records with
+# the pure Python CRC backend, are calculated in a thread pool so the
+# event loop is never blocked by them.
+#
+# A stand-in server that sends the records of files to each client it
+# accepts is included for testing.
+
+import sys
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+
+import ms3crc
+from ms3crc import record_crc
+from ms3reader import RecordView, LENGTHS, LENGTHS_OFFSET
+from ms3record import FIXED_HEADER_LENGTH, FORMAT_VERSION, DEFAULT_BUFFER_SIZE
+
+# Largest record accepted from a stream, larger lengths are taken as
+# a corrupt stream
+MAX_RECORD_LENGTH = DEFAULT_BUFFER_SIZE
+
+# Smallest pooled buffer and number of free buffers kept per size
+MIN_POOL_BUFFER = 512
+MAX_POOL_BUFFERS = 1024
+
+# Records of at least this length have their CRC calculated in the
+# thread pool.  With the C backends smaller records are verified
+# faster on the event loop than a thread pool round trip takes.
+OFFLOAD_LENGTH = 0 if ms3crc.BACKEND == 'python' else 16384
+
+# Records queued per channel and records read ahead of CRC verification
+# per connection
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_IN_FLIGHT = 32
+
+STANDIN_CHUNK_SIZE = 1000
+
+
+# Free record buffers by size.  Sizes are powers of two so buffers can
+# be reused for records of similar length.
+class BufferPool:
+
+    def __init__(self, max_buffers=MAX_POOL_BUFFERS):
+        self.max_buffers = max_buffers
+        self.free = {}
+
+    def acquire(self, length):
+        size = max(MIN_POOL_BUFFER, 1 << (length - 1).bit_length())
+        free = self.free.get(size)
+        return free.pop() if free else bytearray(size)
+
+    def release(self, buffer):
+        free = self.free.setdefault(len(buffer), [])
+        if len(free) < self.max_buffers:
+            free.append(buffer)
+
+
+# A record read from a stream into a pooled buffer.  The buffer goes
+# back to the pool with release(), after which the record and any
+# slices of it must not be used.
+class StreamRecord(RecordView):
+
+    __slots__ = ('storage', 'pool')
+
+    def __init__(self, storage, length, pool):
+        super().__init__(memoryview(storage)[:length])
+        self.storage = storage
+        self.pool = pool
+
+    def release(self):
+        if self.storage is not None:
+            self.pool.release(self.storage)
+            self.storage = None
+
+
+# Fill view from a StreamReader as data arrives.  Return the number of
+# bytes read, less than the length of view only at the end of the
+# stream.
+async def read_into(reader, view):
+    filled = 0
+    while filled < len(view):
+        chunk = await reader.read(len(view) - filled)
+        if not chunk:
+            break
+        view[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+    return filled
+
+
+# Read the next record from a StreamReader into a buffer from pool.
+# Return None at the end of the stream, raise ValueError if the stream
+# ends within a record or is not a stream of records.  Past the fixed
+# header the record is read into the pooled buffer as data arrives.
+async def read_record(reader, pool):
+    try:
+        header = await reader.readexactly(FIXED_HEADER_LENGTH)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise ValueError('Stream ended within a record header') from None
+        return None
+
+    if header[:2] != b'MS' or header[2] != FORMAT_VERSION:
+        raise ValueError('Record indicator not found in stream')
+
+    length = FIXED_HEADER_LENGTH + sum(LENGTHS.unpack_from(header, LENGTHS_OFFSET))
+    if length > MAX_RECORD_LENGTH:
+        raise ValueError(f'Record length {length} exceeds {MAX_RECORD_LENGTH}')
+
+    storage = pool.acquire(length)
+    storage[:FIXED_HEADER_LENGTH] = header
+    try:
+        view = memoryview(storage)[FIXED_HEADER_LENGTH:length]
+        if await read_into(reader, view) < len(view):
+            raise ValueError('Stream ended within a record')
+    except BaseException:
+        pool.release(storage)
+        raise
+
+    return StreamRecord(storage, length, pool)
+
+
+# Iterate over the records of a StreamReader, see read_record()
+async def iter_stream_records(reader, pool=None):
+    pool = pool or BufferPool()
+    while True:
+        record = await read_record(reader, pool)
+        if record is None:
+            return
+        yield record
+
+
+# Ingest of records from any number of streams.  consumer is an async
+# callable that is given each record with a valid CRC; it is called
+# from one task per source identifier, so the records of a channel are
+# consumed one at a time in stream order.  Records are released after
+# the consumer returns.
+class StreamIngest:
+
+    def __init__(self, consumer, executor=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 in_flight=DEFAULT_IN_FLIGHT, verify=True, pool=None):
+        self.consumer = consumer
+        self.executor = executor
+        self.queue_size = queue_size
+        self.in_flight = in_flight
+        self.verify = verify
+        self.pool = pool or BufferPool()
+        self.channels = {}
+        self.stats = collections.Counter()
+
+    # Read records from a stream until it ends.  Usable as the client
+    # connected callback of asyncio.start_server().
+    async def handle_connection(self, reader, writer=None):
+        self.stats['connections'] += 1
+        pending = asyncio.Queue(self.in_flight)
+        verifier = asyncio.create_task(self.dispatch_verified(pending))
+
+        try:
+            async for record in iter_stream_records(reader, self.pool):
+                self.stats['bytes'] += record.length
+                await pending.put((record, self.record_crc(record)))
+        except (ValueError, ConnectionError) as error:
+            self.stats['stream errors'] += 1
+            print(f'Stream error: {error}', file=sys.stderr)
+        finally:
+            await pending.put(None)
+            await verifier
+            if writer is not None:
+                writer.close()
+
+    # Connect to a server and read records from it until it closes the
+    # connection
+    async def connect(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        await self.handle_connection(reader, writer)
+
+    # Return the CRC of a record, or a future of it if it is calculated
+    # in the thread pool
+    def record_crc(self, record):
+        if not self.verify:
+            return record.crc
+        if record.length < OFFLOAD_LENGTH:
+            return record_crc(record.record)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, record_crc, record.record)
+
+    # Check the CRCs of read records in stream order and queue valid
+    # records to their channels
+    async def dispatch_verified(self, pending):
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            record, crc = item
+            if isinstance(crc, asyncio.Future):
+                crc = await crc
+
+            if crc != record.crc:
+                self.stats['CRC errors'] += 1
+                record.release()
+                continue
+
+            try:
+                identifier = record.identifier
+            except UnicodeDecodeError:
+                self.stats['identifier errors'] += 1
+                record.release()
+                continue
+
+            self.stats['records'] += 1
+            await self.channel(identifier).put(record)
+
+    # Return the queue of a channel, starting its consumer task
+    def channel(self, identifier):
+        channel = self.channels.get(identifier)
+        if channel is None:
+            queue = asyncio.Queue(self.queue_size)
+            channel = self.channels[identifier] = (queue, asyncio.create_task(self.consume(queue)))
+        return channel[0]
+
+    # Hand the records of a channel to the consumer.  A consumer error is
+    # counted and reported and the channel keeps draining, so readers
+    # feeding it are never left blocked on a full queue.
+    async def consume(self, queue):
+        while True:
+            record = await queue.get()
+            if record is None:
+                return
+            try:
+                await self.consumer(record)
+            except Exception as error:
+                self.stats['consumer errors'] += 1
+                print(f'Consumer error: {error!r}', file=sys.stderr)
+            finally:
+                record.release()
+
+    # Wait for all queued records to be consumed and stop the channel
+    # tasks
+    async def close(self):
+        for queue, _ in self.channels.values():
+            await queue.put(None)
+        await asyncio.gather(*(task for _, task in self.channels.values()))
+        self.channels.clear()
+
+
+# Start a stand-in server sending data, a bytes-like object of records,
+# to every client in chunks of chunk_size bytes and then closing the
+# connection.  Return the asyncio Server; port 0 picks a free port.
+async def start_standin_server(data, host='127.0.0.1', port=0,
+                               chunk_size=STANDIN_CHUNK_SIZE):
+    data = bytes(data)
+
+    async def send(reader, writer):
+        try:
+            for start in range(0, len(data), chunk_size):
+                writer.write(data[start:start + chunk_size])
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(send, host, port)
+
+
+# Read the records of files and serve them with a stand-in server
+async def serve(paths, host, port, chunk_size):
+    data = bytearray()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            data += fp.read()
+
+    server = await start_standin_server(data, host, port, chunk_size)
+    for sock in server.sockets:
+        print(f'Serving {len(data)} bytes on {sock.getsockname()}', file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+# Connect to servers, count the records and samples of each channel
+# and print them with the ingest statistics
+async def ingest(addresses, connections, workers):
+    counts = collections.defaultdict(lambda: [0, 0])
+
+    async def count(record):
+        channel = counts[record.identifier]
+        channel[0] += 1
+        channel[1] += record.number_samples
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        stream_ingest = StreamIngest(count, executor)
+        await asyncio.gather(*(stream_ingest.connect(host, port)
+                               for host, port in addresses
+                               for _ in range(connections)))
+        await stream_ingest.close()
+
+    for identifier, (records, samples) in sorted(counts.items()):
+        print(f'{identifier} {records} records {samples} samples')
+    print(', '.join(f'{value} {name}' for name, value in sorted(stream_ingest.stats.items())),
+          file=sys.stderr)
+
+
+# Parse an address of the form host:port or port
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve or ingest streams of miniSEED V3 records.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run a stand-in server sending the records of files')
+    serve_parser.add_argument('files', nargs='+',
+                              help='miniSEED V3 files to send')
+    serve_parser.add_argument('-a', '--address', dest='address', default='127.0.0.1:18000',
+                              help='Address to listen on (default 127.0.0.1:18000)')
+    serve_parser.add_argument('-c', '--chunk-size', dest='chunk_size', default=STANDIN_CHUNK_SIZE, type=int,
+                              help=f'Bytes sent per write (default {STANDIN_CHUNK_SIZE})')
+
+    ingest_parser = subparsers.add_parser('ingest', help='Ingest records from servers')
+    ingest_parser.add_argument('addresses', nargs='+',
+                               help='Server addresses as host:port')
+    ingest_parser.add_argument('-n', '--connections', dest='connections', default=1, type=int,
+                               help='Connections to each server (default 1)')
+    ingest_parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                               help='CRC threads (default chosen by the thread pool)')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        host, port = parse_address(args.address)
+        asyncio.run(serve(args.files, host, port, args.chunk_size))
+    else:
+        asyncio.run(ingest([parse_address(address) for address in args.addresses],
+                           args.connections, args.jobs))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+#
+# Assemble miniSEED V3 records into continuous traces with gap and
+# overlap detection.
+#
+# The fixed headers of all records are gathered into NumPy columns, so
+# grouping by source identifier and publication version, sorting by
+# start time and finding the breaks between continuous segments are
+# array operations rather than work on per-record objects.  Each
+# segment is decoded straight into a single array allocated for all of
+# its samples.
+#
+# Times are integer nanoseconds, from the start time fields (4a-4f) and
+# the exact value of the sample rate/period (field 6).  A record
+# continues a segment when its start time is within half a sample
+# period of the time following the last sample of the segment.  Where
+# segments of different publication versions overlap, only the samples
+# of the highest version are kept.
+
+import sys
+import bisect
+import argparse
+import collections
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ms3reader import MS3File, find_files, iter_frames
+from ms3payload import DECODED_TYPES, decode_payloads
+from ms3record import (FIXED_HEADER_LENGTH, NS_PER_SECOND, year_epoch_days,
+                       sample_interval_ns, nstime_to_isotime)
+
+# The fixed header as a NumPy structured type, see ms3record.py
+HEADER_TYPE = np.dtype([
+    ('indicator', 'S2'),
+    ('format_version', 'u1'),
+    ('flags', 'u1'),
+    ('nanosecond', '<u4'),
+    ('year', '<u2'),
+    ('day', '<u2'),
+    ('hour', 'u1'),
+    ('minute', 'u1'),
+    ('second', 'u1'),
+    ('encoding', 'u1'),
+    ('sample_rate_period', '<f8'),
+    ('number_samples', '<u4'),
+    ('crc', '<u4'),
+    ('pub_version', 'u1'),
+    ('length_identifier', 'u1'),
+    ('length_extra_header', '<u2'),
+    ('length_payload', '<u4'),
+])
+
+# A continuous series of samples starting at start_time
+Segment = collections.namedtuple('Segment', [
+    'identifier',
+    'pub_version',
+    'start_time',
+    'sample_rate_period',
+    'samples',
+])
+
+# A gap or overlap between consecutive records of a source identifier
+# and publication version.  end_time is the time of the last sample
+# before it, start_time that of the first sample after it.  duration is
+# the difference of start_time from the time expected for the next
+# sample, positive for a gap and negative for an overlap.
+Discontinuity = collections.namedtuple('Discontinuity', [
+    'identifier',
+    'pub_version',
+    'end_time',
+    'start_time',
+    'duration',
+])
+
+
+# Return the time of a sample of a segment
+def sample_time(segment, index):
+    return segment.start_time + sample_interval_ns(segment.sample_rate_period, index)
+
+
+# Return the time of the last sample of a segment
+def segment_end(segment):
+    return sample_time(segment, max(len(segment.samples) - 1, 0))
+
+
+# Return the time following the last sample of a segment
+def segment_next(segment):
+    return sample_time(segment, len(segment.samples))
+
+
+# Return the index of the first sample of a segment at or after time,
+# or the number of samples if there is none
+def sample_index(segment, time):
+    count = len(segment.samples)
+    if time <= segment.start_time:
+        return 0
+    if time > segment_end(segment):
+        return count
+
+    # Estimate from the nominal interval and correct for rounding
+    interval = max(sample_interval_ns(segment.sample_rate_period), 1)
+    index = min((time - segment.start_time) // interval, count)
+    while index > 0 and sample_time(segment, index - 1) >= time:
+        index -= 1
+    while index < count and sample_time(segment, index) < time:
+        index += 1
+    return index
+
+
+# Return a segment limited to the samples from start to end, the
+# samples are a view of the segment's
+def slice_segment(segment, start, end):
+    return segment._replace(start_time=sample_time(segment, start),
+                            samples=segment.samples[start:end])
+
+
+# Return rows of width bytes of data starting at each of starts, zero
+# filled beyond the end of data
+def gather_bytes(data, starts, width):
+    rows = np.zeros((len(starts), width), dtype=np.uint8)
+    inside = starts + width <= len(data)
+    if width and len(data) >= width:
+        rows[inside] = sliding_window_view(data, width)[starts[inside]]
+    for row in np.flatnonzero(~inside):
+        tail = data[starts[row]:]
+        rows[row, :len(tail)] = tail
+    return rows
+
+
+# Fixed header fields of the records of one or more buffers as NumPy
+# columns.  identifiers is the sorted list of source identifiers and
+# codes the index of each record's identifier in it.
+class RecordTable:
+
+    def __init__(self, buffers, buffer_numbers, offsets, headers, identifiers, codes):
+        self.buffers = buffers
+        self.buffer_numbers = buffer_numbers
+        self.offsets = offsets
+        self.headers = headers
+        self.identifiers = identifiers
+        self.codes = codes
+
+        # Start times from fields 4a-4f, see fields_to_nstime()
+        years, year_codes = np.unique(headers['year'], return_inverse=True)
+        epoch_days = np.array([year_epoch_days(int(year)) for year in years], dtype=np.int64)
+        seconds = ((epoch_days[year_codes.reshape(-1)] + headers['day'] - 1) * 86400 +
+                   headers['hour'].astype(np.int64) * 3600 +
+                   headers['minute'].astype(np.int64) * 60 +
+                   headers['second'])
+        self.start_times = seconds * NS_PER_SECOND + headers['nanosecond']
+
+        self.payload_offsets = (offsets + FIXED_HEADER_LENGTH +
+                                headers['length_identifier'] +
+                                headers['length_extra_header'])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Return a table of all records in a buffer.  The buffer must stay
+    # valid while payloads are read from the table.
+    @classmethod
+    def from_buffer(cls, buffer):
+        buffer = memoryview(buffer).cast('B')
+        offsets = np.fromiter((offset for offset, _ in iter_frames(buffer)),
+                              dtype=np.int64)
+        data = np.frombuffer(buffer, dtype=np.uint8)
+
+        headers = gather_bytes(data, offsets, FIXED_HEADER_LENGTH).view(HEADER_TYPE).reshape(-1)
+        if len(headers) and (headers['format_version'] != 3).any():
+            raise ValueError('Unsupported format version in buffer')
+
+        # Identifiers as zero padded byte strings of the longest length
+        lengths = headers['length_identifier']
+        width = max(int(lengths.max()) if len(lengths) else 0, 1)
+        raw = gather_bytes(data, offsets + FIXED_HEADER_LENGTH, width)
+        raw[np.arange(width) >= lengths[:, None]] = 0
+        names, codes = np.unique(raw.view(f'S{width}').reshape(-1), return_inverse=True)
+
+        return cls([buffer], np.zeros(len(offsets), dtype=np.int64), offsets, headers,
+                   [str(name, 'ascii') for name in names], codes.reshape(-1))
+
+    # Return a single table of the records of tables
+    @classmethod
+    def concatenate(cls, tables):
+        tables = list(tables)
+        identifiers = sorted({identifier for table in tables
+                              for identifier in table.identifiers})
+        numbers = {identifier: number for number, identifier in enumerate(identifiers)}
+
+        buffers = []
+        buffer_numbers = [np.zeros(0, dtype=np.int64)]
+        offsets = [np.zeros(0, dtype=np.int64)]
+        headers = [np.zeros(0, dtype=HEADER_TYPE)]
+        codes = [np.zeros(0, dtype=np.int64)]
+        for table in tables:
+            mapping = np.array([numbers[identifier] for identifier in table.identifiers] or [0],
+                               dtype=np.int64)
+            buffer_numbers.append(table.buffer_numbers + len(buffers))
+            offsets.append(table.offsets)
+            headers.append(table.headers)
+            codes.append(mapping[table.codes])
+            buffers.extend(table.buffers)
+
+        return cls(buffers, np.concatenate(buffer_numbers), np.concatenate(offsets),
+                   np.concatenate(headers), identifiers, np.concatenate(codes))
+
+    # Return the payload of a record as a memoryview
+    def payload(self, number):
+        start = int(self.payload_offsets[number])
+        length = int(self.headers['length_payload'][number])
+        return self.buffers[self.buffer_numbers[number]][start:start + length]
+
+
+# Return the durations of records with counts samples at a sample
+# rate/period.  Periods of a whole number of nanoseconds are multiplied
+# out, others are calculated exactly for each distinct count.
+def record_spans(sample_rate_period, counts):
+    interval = sample_interval_ns(sample_rate_period)
+    if sample_interval_ns(sample_rate_period, NS_PER_SECOND) == interval * NS_PER_SECOND:
+        return counts.astype(np.int64) * interval
+
+    distinct, inverse = np.unique(counts, return_inverse=True)
+    spans = np.array([sample_interval_ns(sample_rate_period, int(count)) for count in distinct],
+                     dtype=np.int64)
+    return spans[inverse.reshape(-1)]
+
+
+# Decode the records of a table at numbers, in order, into one array.
+# Each run of records of the same encoding is decoded in one call.
+def decode_records(table, numbers):
+    headers = table.headers[numbers]
+    encodings = headers['encoding']
+    counts = headers['number_samples'].astype(np.int64)
+    dtype = np.result_type(*(DECODED_TYPES[int(encoding)]
+                             for encoding in np.unique(encodings)))
+
+    samples = np.empty(int(counts.sum()), dtype=dtype)
+    ends = np.cumsum(counts)
+    runs = np.concatenate(([0], np.flatnonzero(encodings[1:] != encodings[:-1]) + 1,
+                           [len(numbers)])).tolist()
+    for first, last in zip(runs[:-1], runs[1:]):
+        start = int(ends[first] - counts[first])
+        decode_payloads([table.payload(number) for number in numbers[first:last].tolist()],
+                        int(encodings[first]), counts[first:last].tolist(),
+                        out=samples[start:int(ends[last - 1])])
+    return samples
+
+
+# Assemble the records of a table into segments of each source
+# identifier and publication version, return (segments,
+# discontinuities).  Records without samples, without a sample
+# rate/period or with encodings that do not decode to samples are
+# skipped.  tolerance is the largest difference in nanoseconds from the
+# expected start time at which a record continues a segment, by
+# default half a sample period.
+def assemble_table(table, tolerance=None):
+    headers = table.headers
+    usable = np.flatnonzero((headers['number_samples'] > 0) &
+                            (headers['sample_rate_period'] != 0.0) &
+                            np.isin(headers['encoding'], list(DECODED_TYPES)))
+    order = usable[np.lexsort((table.start_times[usable],
+                               headers['pub_version'][usable],
+                               table.codes[usable]))]
+    if len(order) == 0:
+        return [], []
+
+    codes = table.codes[order]
+    versions = headers['pub_version'][order]
+    rates = headers['sample_rate_period'][order]
+    counts = headers['number_samples'][order]
+    starts = table.start_times[order]
+
+    # Time following the last sample of each record, and the tolerance
+    # of a record continuing the one before it
+    nexts = np.empty(len(order), dtype=np.int64)
+    tolerances = np.full(len(order), tolerance or 0, dtype=np.int64)
+    for rate in np.unique(rates).tolist():
+        selected = rates == rate
+        nexts[selected] = starts[selected] + record_spans(rate, counts[selected])
+        if tolerance is None:
+            tolerances[selected] = sample_interval_ns(rate) // 2
+
+    # Segments break between records of different groups or sample
+    # rates/periods, and at gaps and overlaps
+    differences = starts[1:] - nexts[:-1]
+    same_group = (codes[1:] == codes[:-1]) & (versions[1:] == versions[:-1])
+    discontinuous = same_group & (np.abs(differences) > tolerances[1:])
+    breaks = ~same_group | (rates[1:] != rates[:-1]) | discontinuous
+    firsts = np.concatenate(([0], np.flatnonzero(breaks) + 1, [len(order)]))
+
+    discontinuities = [
+        Discontinuity(table.identifiers[codes[i]], int(versions[i]),
+                      int(starts[i]) + sample_interval_ns(float(rates[i]), int(counts[i]) - 1),
+                      int(starts[i + 1]), int(differences[i]))
+        for i in np.flatnonzero(discontinuous).tolist()]
+
+    segments = [Segment(table.identifiers[codes[first]], int(versions[first]),
+                        int(starts[first]), float(rates[first]),
+                        decode_records(table, order[first:last]))
+                for first, last in zip(firsts[:-1].tolist(), firsts[1:].tolist())]
+
+    return segments, discontinuities
+
+
+# Return segments with the samples of each source identifier that are
+# also in a segment of a higher publication version removed, ordered by
+# identifier and start time.  Remaining parts of segments are views of
+# the samples.
+def resolve_versions(segments):
+    resolved = []
+    by_identifier = collections.defaultdict(list)
+    for segment in segments:
+        by_identifier[segment.identifier].append(segment)
+
+    for identifier in sorted(by_identifier):
+        versions = collections.defaultdict(list)
+        for segment in by_identifier[identifier]:
+            versions[segment.pub_version].append(segment)
+
+        # Time spans [first sample, following time) of higher versions,
+        # sorted and merged
+        covered = []
+        kept = []
+        for pub_version in sorted(versions, reverse=True):
+            for segment in versions[pub_version]:
+                kept.extend(uncovered_parts(segment, covered))
+            for segment in versions[pub_version]:
+                covered = merge_span(covered, segment.start_time, segment_next(segment))
+
+        kept.sort(key=lambda segment: (segment.start_time, -segment.pub_version))
+        resolved.extend(kept)
+
+    return resolved
+
+
+# Return a list of sorted, non-overlapping spans with a span merged in
+def merge_span(spans, start, end):
+    first = bisect.bisect_left(spans, (start,))
+    if first > 0 and spans[first - 1][1] >= start:
+        first -= 1
+    last = first
+    while last < len(spans) and spans[last][0] <= end:
+        start = min(start, spans[last][0])
+        end = max(end, spans[last][1])
+        last += 1
+    return spans[:first] + [(start, end)] + spans[last:]
+
+
+# Yield the parts of a segment with samples outside the covered spans.
+# As when joining records, times within half a sample period are the
+# same: a sample is covered by a span [start, end) if its time is in
+# [start - half, end - half), so rounding of the times of either
+# segment does not drop or keep a sample at the edges.
+def uncovered_parts(segment, covered):
+    position = 0
+    count = len(segment.samples)
+    half = sample_interval_ns(segment.sample_rate_period) // 2
+    first = bisect.bisect_left(covered, (segment.start_time,))
+    if first > 0:
+        first -= 1
+
+    for start, end in covered[first:]:
+        if position >= count or start - half > segment_end(segment):
+            break
+        cover_start = sample_index(segment, start - half)
+        cover_end = sample_index(segment, end - half)
+        if cover_start > position:
+            yield slice_segment(segment, position, cover_start)
+        position = max(position, cover_end)
+
+    if position < count:
+        yield slice_segment(segment, position, count)
+
+
+# Assemble the records of files, return (segments, discontinuities).
+# Segments of a source identifier overlapping a higher publication
+# version are trimmed, discontinuities are those within each version.
+def assemble_files(paths, tolerance=None):
+    files = [MS3File(path) for path in paths]
+    try:
+        table = RecordTable.concatenate(RecordTable.from_buffer(ms3file.buffer)
+                                        for ms3file in files)
+        segments, discontinuities = assemble_table(table, tolerance)
+        del table
+    finally:
+        for ms3file in files:
+            ms3file.close()
+
+    return resolve_versions(segments), discontinuities
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Assemble miniSEED V3 records into continuous traces.')
+
+    parser.add_argument('files', nargs='+',
+                        help='miniSEED V3 files or directories to search for them')
+    parser.add_argument('-p', '--pattern', dest='pattern', default='*.mseed3',
+                        help='File name pattern in directories (default "*.mseed3")')
+    parser.add_argument('-t', '--tolerance', dest='tolerance', default=None, type=int,
+                        help='Time tolerance in nanoseconds (default half a sample period)')
+    parser.add_argument('-g', '--gaps', dest='gaps', action='store_true',
+                        help='List gaps and overlaps instead of segments')
+
+    args = parser.parse_args()
+
+    segments, discontinuities = assemble_files(list(find_files(args.files, args.pattern)),
+                                               args.tolerance)
+
+    if args.gaps:
+        for discontinuity in discontinuities:
+            kind = 'gap' if discontinuity.duration > 0 else 'overlap'
+            print(f'{discontinuity.identifier} v{discontinuity.pub_version} '
+                  f'{nstime_to_isotime(discontinuity.end_time)} '
+                  f'{nstime_to_isotime(discontinuity.start_time)} '
+                  f'{kind} {abs(discontinuity.duration) / NS_PER_SECOND:.9f}s')
+        return
+
+    for segment in segments:
+        print(f'{segment.identifier} v{segment.pub_version} '
+              f'{nstime_to_isotime(segment.start_time)} '
+              f'{nstime_to_isotime(segment_end(segment))} '
+              f'{segment.sample_rate_period:g} {len(segment.samples)} samples')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        exit(1)
@@ -0,0 +1,416 @@
+#
+# Steim-1 (encoding 10) and Steim-2 (encoding 11) integer compression
+# using NumPy array operations.
+#
+# The compression is described in the SEED 2.4 manual, Appendix B.  A
+# payload is a sequence of 64-byte frames of sixteen big-endian 32-bit
+# words.  Word 0 of each frame holds sixteen 2-bit control nibbles
+# describing each word of the frame.  Words 1 and 2 of the first frame
+# are the forward (first sample) and reverse (last sample) integration
+# constants, all other words hold packed sample differences.
+#
+# Decoding unpacks all words of a payload at once.  Encoding classifies
+# every difference by the bit widths it fits in, chooses the largest
+# group at each position with the same greedy rule as libmseed, and
+# walks the chosen groups with pointer doubling instead of a loop over
+# samples.
+
+import collections
+
+import numpy as np
+
+FRAME_LENGTH = 64
+FRAME_WORDS = 16
+
+# Data words available in the first frame and in each following frame
+FIRST_FRAME_WORDS = 13
+FRAME_DATA_WORDS = 15
+
+# Word classes as (nibble, dnib, number of differences, bit width).
+# The dnib is the top two bits of a Steim-2 data word.  Classes are in
+# order of preference when encoding.
+STEIM1_CLASSES = (
+    (1, 0, 4, 8),
+    (2, 0, 2, 16),
+    (3, 0, 1, 32),
+)
+
+STEIM2_CLASSES = (
+    (3, 2, 7, 4),
+    (3, 1, 6, 5),
+    (3, 0, 5, 6),
+    (1, 0, 4, 8),
+    (2, 3, 3, 10),
+    (2, 2, 2, 15),
+    (2, 1, 1, 30),
+)
+
+
+# Lookup tables of the data words of a compression indexed by nibble *
+# 4 + dnib: the number of differences in the word (-1 for invalid
+# combinations, 0 for words without data), and by key * lanes + lane,
+# the position of a difference in its word: the left shift that brings
+# the difference to the top of the word and the right shift that brings
+# it back sign extended.  Steim-1 and the Steim-2 8-bit class do not use
+# a dnib, so every dnib value of those nibbles maps to the same class.
+DecodeTable = collections.namedtuple('DecodeTable', ['counts', 'lanes', 'left', 'right'])
+
+
+def decode_table(classes, steim1):
+    lanes = max(cls[2] for cls in classes)
+    counts = np.full(16, -1, dtype=np.int8)
+    counts[:4] = 0
+    left = np.zeros((16, lanes), dtype=np.uint32)
+    right = np.zeros((16, lanes), dtype=np.int32)
+    for nibble, dnib, count, width in classes:
+        for key in (range(4) if steim1 or nibble == 1 else (dnib,)):
+            key += nibble * 4
+            counts[key] = count
+            left[key, :count] = 32 - width * np.arange(count, 0, -1)
+            right[key, :count] = 32 - width
+    return DecodeTable(counts, lanes, left.ravel(), right.ravel())
+
+
+STEIM1_DECODE = decode_table(STEIM1_CLASSES, True)
+STEIM2_DECODE = decode_table(STEIM2_CLASSES, False)
+
+NIBBLE_SHIFTS = np.arange(30, -2, -2, dtype=np.uint32)
+
+# Nibbles of the words described by each byte of a control word, times
+# 4 as in the table keys
+BYTE_KEYS = (((np.arange(256)[:, None] >> np.arange(6, -2, -2)) & 3) * 4).astype(np.uint8)
+
+# Frames unpacked at a time, which bounds the memory used for the
+# differences of each word beyond the output
+DECODE_CHUNK_FRAMES = 1024
+
+DATA_SLOT = np.ones(FRAME_WORDS, dtype=bool)
+DATA_SLOT[0] = False
+
+
+# Return the frames of a payload as an (N, 16) array of big-endian
+# uint32 words viewing the payload
+def payload_frames(payload):
+    length = len(payload) - len(payload) % FRAME_LENGTH
+    words = np.frombuffer(payload, dtype='>u4', count=length // 4)
+    return words.reshape(-1, FRAME_WORDS)
+
+
+# Unpack the differences of all data words in frames.  firsts are the
+# numbers of the first frames of payloads, which hold the integration
+# constants.  The differences are written to an output allocated from
+# the number in each word.  Each data word is repeated once per
+# difference it holds and every difference is shifted by the table
+# entries of its lane, in chunks of frames.  Return the differences and
+# the cumulative number of differences at the end of each frame.
+def decode_differences(frames, table, firsts=0):
+    words = frames.astype(np.uint32).ravel()
+    keys = BYTE_KEYS[frames.view(np.uint8)[:, :4]].reshape(-1, FRAME_WORDS)
+    keys[:, 0] = 0  # Control word
+    keys[firsts, 1:3] = 0  # Integration constants
+    keys = keys.ravel()
+    keys |= (words >> 30).astype(np.uint8)
+
+    counts = table.counts[keys]
+    if counts.min() < 0:
+        raise ValueError('Invalid Steim data word')
+    ends = np.cumsum(counts, dtype=np.int64)
+    differences = np.empty(int(ends[-1]), dtype=np.int32)
+
+    chunk = DECODE_CHUNK_FRAMES * FRAME_WORDS
+    for first in range(0, len(words), chunk):
+        part = slice(first, first + chunk)
+        start = int(ends[first] - counts[first])
+        end = int(ends[part][-1])
+
+        # The lane of each difference is its position in the output less
+        # the start of its word, offset by the table row of the word's key
+        offsets = ends[part] - counts[part]
+        offsets -= start
+        lanes = np.repeat(keys[part] * np.intp(table.lanes) - offsets, counts[part])
+        lanes += np.arange(len(lanes))
+
+        # Shift each difference to the top of the word, then back down
+        # as a signed value to sign extend it
+        values = np.repeat(words[part], counts[part])
+        values <<= table.left[lanes]
+        values = values.view(np.int32)
+        values >>= table.right[lanes]
+        differences[start:end] = values
+
+    return differences, ends[FRAME_WORDS - 1::FRAME_WORDS]
+
+
+def decode(payload, number_samples, table, check, out):
+    if number_samples == 0:
+        return np.zeros(0, dtype=np.int32) if out is None else out
+
+    frames = payload_frames(payload)
+    if len(frames) == 0:
+        raise ValueError('Steim payload contains no frames')
+
+    differences, _ = decode_differences(frames, table)
+    if len(differences) < number_samples:
+        raise ValueError(f'Steim payload contains {len(differences)} '
+                         f'samples, expected {number_samples}')
+
+    # The first difference refers to a previous record and is not used,
+    # samples are integrated forward from the first sample and wrap as
+    # 32-bit integers
+    constants = frames[0, 1:3].view('>i4')
+    samples = differences[:number_samples]
+    samples[0] = constants[0]
+    samples = np.cumsum(samples, dtype=np.int32, out=out)
+
+    if check and samples[-1] != constants[1]:
+        raise ValueError(f'Steim last sample {samples[-1]} does not match '
+                         f'reverse integration constant {constants[1]}')
+
+    return samples
+
+
+# Decode a Steim-1 payload into an int32 array of number_samples, or
+# into out, an int32 array of that length
+def decode_steim1(payload, number_samples, check=True, out=None):
+    return decode(payload, number_samples, STEIM1_DECODE, check, out)
+
+
+# Decode a Steim-2 payload, see decode_steim1()
+def decode_steim2(payload, number_samples, check=True, out=None):
+    return decode(payload, number_samples, STEIM2_DECODE, check, out)
+
+
+# Decode a sequence of payloads, each of the number of samples at the
+# same position in number_samples, into one array.  All frames are
+# unpacked in a single pass and samples are integrated with a single
+# cumulative sum, each payload from its own forward integration
+# constant.
+def decode_many(payloads, number_samples, table, check, out):
+    payloads = [payload for payload, count in zip(payloads, number_samples) if count]
+    counts = np.array([count for count in number_samples if count], dtype=np.int64)
+    total = int(counts.sum())
+    if out is None:
+        out = np.empty(total, dtype=np.int32)
+    if total == 0:
+        return out
+
+    lengths = np.array([len(payload) // FRAME_LENGTH for payload in payloads], dtype=np.int64)
+    if not lengths.all():
+        raise ValueError('Steim payload contains no frames')
+    frames = np.frombuffer(b''.join(payload[:length * FRAME_LENGTH]
+                                    for payload, length in zip(payloads, lengths)),
+                           dtype='>u4').reshape(-1, FRAME_WORDS)
+    firsts = np.cumsum(lengths) - lengths
+
+    differences, frame_ends = decode_differences(frames, table, firsts)
+    available_ends = frame_ends[firsts + lengths - 1]
+    available_starts = np.concatenate(([0], available_ends[:-1]))
+    short = np.flatnonzero(available_ends - available_starts < counts)
+    if len(short):
+        raise ValueError(f'Steim payload {short[0]} contains '
+                         f'{available_ends[short[0]] - available_starts[short[0]]} '
+                         f'samples, expected {counts[short[0]]}')
+
+    # Take the first differences of each payload, the first of which is
+    # replaced by the forward integration constant.  One running sum
+    # over all payloads less the sum at the start of each gives the
+    # samples of each, wrapping as 32-bit integers.
+    starts = np.cumsum(counts) - counts
+    constants = frames[firsts, 1:3].view('>i4')
+    positions = np.arange(total) + np.repeat(available_starts - starts, counts)
+    samples = differences[positions]
+    samples[starts] = constants[:, 0]
+    np.cumsum(samples, dtype=np.int32, out=out)
+    bases = np.zeros(len(counts), dtype=np.int32)
+    bases[1:] = out[starts[1:] - 1]
+    out -= np.repeat(bases, counts)
+
+    if check:
+        mismatched = np.flatnonzero(out[starts + counts - 1] != constants[:, 1])
+        if len(mismatched):
+            number = mismatched[0]
+            raise ValueError(f'Steim last sample {out[starts[number] + counts[number] - 1]} '
+                             f'does not match reverse integration constant '
+                             f'{constants[number, 1]}')
+
+    return out
+
+
+# Decode Steim-1 payloads into one int32 array, or into out, an int32
+# array of the total number of samples
+def decode_steim1_many(payloads, number_samples, check=True, out=None):
+    return decode_many(payloads, number_samples, STEIM1_DECODE, check, out)
+
+
+# Decode Steim-2 payloads, see decode_steim1_many()
+def decode_steim2_many(payloads, number_samples, check=True, out=None):
+    return decode_many(payloads, number_samples, STEIM2_DECODE, check, out)
+
+
+# Return, for each difference, the number of the narrowest of widths
+# (in ascending order) that holds it, or len(widths) if none do
+def width_levels(differences, widths):
+    magnitude = np.where(differences < 0, ~differences, differences)
+    limits = np.array([1 << (width - 1) for width in widths])
+    return np.searchsorted(limits, magnitude, side='right').astype(np.int8)
+
+
+# Return the class number chosen at each position, -1 if no class fits.
+# A class fits if the widest difference in the window of its count
+# starting at the position fits its width.
+def choose_classes(differences, classes):
+    length = len(differences)
+    widths = sorted({cls[3] for cls in classes})
+    levels = width_levels(differences, widths)
+
+    # Window maxima of levels, windows running off the end never fit
+    windows = [None, levels]
+    for count in range(2, max(cls[2] for cls in classes) + 1):
+        span = max(length - count + 1, 0)
+        window = np.full(length, len(widths), dtype=np.int8)
+        np.maximum(windows[-1][:span], levels[count - 1:count - 1 + span],
+                   out=window[:span])
+        windows.append(window)
+
+    choice = np.full(length, -1, dtype=np.int8)
+    for number in range(len(classes) - 1, -1, -1):
+        _, _, count, width = classes[number]
+        choice[windows[count] <= widths.index(width)] = number
+
+    return choice
+
+
+# Return the start positions of data words given the number of
+# differences taken by a word starting at each position.  The chain
+# 0, take[0], ... is followed by pointer doubling: with jump holding
+# the position 2**k words ahead, the next 2**k word starts are the
+# jumps from the first 2**k.  Stop once more than limit are known.
+def word_starts(take, limit=None):
+    length = len(take)
+    jump = np.append(np.arange(length, dtype=np.int32) + take, length)
+    jump = jump.astype(np.int32)
+    starts = np.zeros(1, dtype=np.int32)
+
+    while starts[-1] < length and (limit is None or len(starts) <= limit):
+        starts = np.concatenate((starts, jump[starts]))
+        jump = jump[jump]
+
+    return starts[starts < length]
+
+
+def encode(samples, classes, max_frames, diff0):
+    samples = np.asarray(samples)
+    if samples.ndim != 1:
+        raise ValueError('Samples must be a one dimensional array')
+    if len(samples) and (samples.min() < -2**31 or samples.max() >= 2**31):
+        raise ValueError('Samples must be 32-bit integers')
+
+    samples = samples.astype(np.int32)
+    length = len(samples)
+    if length == 0:
+        return b'', 0
+
+    # Differences wrap as 32-bit integers, as they do when decoded
+    differences = np.empty(length, dtype=np.int32)
+    differences[0] = diff0
+    np.subtract(samples[1:], samples[:-1], out=differences[1:])
+
+    choice = choose_classes(differences, classes)
+    counts = np.array([cls[2] for cls in classes] + [1], dtype=np.int32)
+    take = counts[choice]  # -1 selects the trailing count of 1
+
+    capacity = None
+    if max_frames is not None:
+        capacity = FIRST_FRAME_WORDS + FRAME_DATA_WORDS * (max_frames - 1)
+
+    starts = word_starts(take, capacity)
+    if capacity is not None and len(starts) > capacity:
+        starts = starts[:capacity]
+
+    number_samples = int(starts[-1] + take[starts[-1]])
+
+    chosen = choice[starts]
+    if np.any(chosen < 0):
+        raise ValueError('Sample difference too large for Steim encoding')
+
+    # Pack the differences of each word, most significant first
+    unsigned = differences.view(np.uint32)
+    words = np.empty(len(starts), dtype=np.uint32)
+    nibbles = np.empty(len(starts), dtype=np.uint32)
+
+    for number, (nibble, dnib, count, width) in enumerate(classes):
+        group = chosen == number
+        if not group.any():
+            continue
+
+        shifts = (width * np.arange(count - 1, -1, -1)).astype(np.uint32)
+        values = unsigned[starts[group][:, None] + np.arange(count)]
+        values &= np.uint32((1 << width) - 1)
+        words[group] = (np.bitwise_or.reduce(values << shifts, axis=1) |
+                        np.uint32(dnib << 30))
+        nibbles[group] = nibble
+
+    # Place words in frame slots, skipping control words and the
+    # integration constants
+    word_count = len(words)
+    frame_count = 1 + max(0, -(-(word_count - FIRST_FRAME_WORDS) // FRAME_DATA_WORDS))
+    slots = np.flatnonzero(np.tile(DATA_SLOT, frame_count))[2:word_count + 2]
+
+    frames = np.zeros(frame_count * FRAME_WORDS, dtype=np.uint32)
+    control = np.zeros(frame_count * FRAME_WORDS, dtype=np.uint32)
+    frames[slots] = words
+    control[slots] = nibbles
+
+    frames = frames.reshape(-1, FRAME_WORDS)
+    frames[:, 0] = np.bitwise_or.reduce(control.reshape(-1, FRAME_WORDS) << NIBBLE_SHIFTS,
+                                        axis=1)
+    frames[0, 1:3] = samples[[0, number_samples - 1]].view(np.uint32)
+
+    return frames.astype('>u4').tobytes(), number_samples
+
+
+# Encode samples with Steim-1 compression.  Return the payload and the
+# number of samples encoded, which is less than the number given when
+# max_frames limits the payload length.  diff0 is the first difference,
+# the first sample minus the last sample of the previous record.
+def encode_steim1(samples, max_frames=None, diff0=0):
+    return encode(samples, STEIM1_CLASSES, max_frames, diff0)
+
+
+# Encode samples with Steim-2 compression, see encode_steim1()
+def encode_steim2(samples, max_frames=None, diff0=0):
+    return encode(samples, STEIM2_CLASSES, max_frames, diff0)
+
+
+# Byte permutations of the words of a little-endian payload by nibble.
+# libmseed 2 swaps each difference on its own when writing little-endian
+# records, so 8-bit differences keep their order and the two 16-bit
+# differences of a Steim-1 word are swapped in place.  Control words and
+# integration constants are swapped as whole words.
+REVERSE_WORD = (3, 2, 1, 0)
+STEIM1_SWAPS = np.array([REVERSE_WORD, (0, 1, 2, 3), (1, 0, 3, 2), REVERSE_WORD])
+STEIM2_SWAPS = np.array([REVERSE_WORD, (0, 1, 2, 3), REVERSE_WORD, REVERSE_WORD])
+
+
+# Return a little-endian payload with the bytes of each word permuted
+# according to its nibble
+def swap_payload(payload, swaps):
+    length = len(payload) - len(payload) % FRAME_LENGTH
+    data = np.frombuffer(payload, dtype=np.uint8, count=length).reshape(-1, FRAME_WORDS, 4)
+    controls = np.frombuffer(payload, dtype='<u4', count=length // 4)[::FRAME_WORDS]
+    nibbles = (controls.astype(np.uint32)[:, None] >> NIBBLE_SHIFTS) & 3
+    nibbles[:, 0] = 0
+    nibbles[0, 1:3] = 0
+    return np.take_along_axis(data, swaps[nibbles], axis=2).tobytes()
+
+
+# Convert a little-endian Steim-1 payload to the standard big-endian
+# payload
+def swap_steim1(payload):
+    return swap_payload(payload, STEIM1_SWAPS)
+
+
+# Convert a little-endian Steim-2 payload to the standard big-endian
+# payload
+def swap_steim2(payload):
+    return swap_payload(payload, STEIM2_SWAPS)
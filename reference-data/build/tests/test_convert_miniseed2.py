@@ -0,0 +1,175 @@
+#
+# Tests of the miniSEED 2.4 to V3 converter.
+
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import steim
+from convert_miniseed2 import FSDH, convert_stream
+from ms3payload import decode_payload
+from ms3reader import iter_records
+from ms3record import RecordWriter
+
+BTIME = struct.Struct('>HHBBBxH')
+RECORD_EXPONENT = 12
+START = (2022, 156, 20, 32, 38, 1234)
+
+rng = np.random.default_rng(0)
+SAMPLES = np.cumsum(rng.integers(-2000, 2000, 400)).astype(np.int32)
+
+
+# Return a miniSEED 2.4 record in a byte order with blockettes 1000 and
+# 1001 followed by blockettes, each a (type, body) pair with the body
+# following the blockette header packed in that byte order
+def ms2_record(order, encoding, payload, number_samples, blockettes=(), word_order=None,
+               microsecond=0, correction=0, activity=0):
+    word_order = order if word_order is None else word_order
+    chain = [(1000, bytes([encoding, word_order == '>', RECORD_EXPONENT, 0])),
+             (1001, struct.pack('BbxB', 90, microsecond, 0))]
+    chain += blockettes
+
+    body = b''
+    position = FSDH[order].size
+    for number, (kind, content) in enumerate(chain):
+        following = position + 4 + len(content) if number + 1 < len(chain) else 0
+        body += struct.pack(order + 'HH', kind, following) + content
+        position += 4 + len(content)
+    data_offset = -(-(FSDH[order].size + len(body)) // 64) * 64
+
+    header = FSDH[order].pack(b'000001', b'D', b'ANMO ', b'00', b'BHZ', b'IU', *START,
+                              number_samples, 20, 1, activity, 0x20, 0, len(chain),
+                              correction, data_offset, FSDH[order].size)
+    record = (header + body).ljust(data_offset, b'\0') + payload
+    return record.ljust(1 << RECORD_EXPONENT, b'\0')
+
+
+# Convert records, return the V3 records and the convert_stream() result
+def convert(*records):
+    output = io.BytesIO()
+    with RecordWriter(output) as writer:
+        result = convert_stream(io.BytesIO(b''.join(records)), writer)
+    return list(iter_records(output.getvalue())), result
+
+
+# Return the decoded extra headers of a record
+def extra_headers(record):
+    return json.loads(bytes(record.extra_header))
+
+
+# Return a Steim payload as written in little-endian records by
+# libmseed 2, the inverse of steim.swap_steim1() or swap_steim2()
+def little_endian_steim(payload, swaps):
+    data = np.frombuffer(payload, dtype=np.uint8).reshape(-1, steim.FRAME_WORDS, 4)
+    controls = np.frombuffer(payload, dtype='>u4')[::steim.FRAME_WORDS].astype(np.uint32)
+    nibbles = (controls[:, None] >> steim.NIBBLE_SHIFTS) & 3
+    nibbles[:, 0] = 0
+    nibbles[0, 1:3] = 0
+    return np.take_along_axis(data, swaps[nibbles], axis=2).tobytes()
+
+
+@pytest.mark.parametrize('order', '<>')
+@pytest.mark.parametrize('encoding, dtype', [(1, 'i2'), (3, 'i4'), (4, 'f4'), (5, 'f8')])
+def test_fixed_width_byte_orders(order, encoding, dtype):
+    samples = SAMPLES.astype(dtype)
+    records, (count, _, errors, _) = convert(
+        ms2_record(order, encoding, samples.astype(order + dtype).tobytes(), len(samples)))
+    assert (count, errors) == (1, [])
+
+    record = records[0]
+    assert record.encoding == encoding
+    np.testing.assert_array_equal(
+        decode_payload(record.payload, record.encoding, record.number_samples), samples)
+
+
+@pytest.mark.parametrize('order', '<>')
+@pytest.mark.parametrize('encoding, encode, swaps', [
+    (10, steim.encode_steim1, steim.STEIM1_SWAPS),
+    (11, steim.encode_steim2, steim.STEIM2_SWAPS),
+])
+def test_steim_byte_orders(order, encoding, encode, swaps):
+    payload, count = encode(SAMPLES)
+    written = payload if order == '>' else little_endian_steim(payload, swaps)
+    records, (_, _, errors, _) = convert(ms2_record(order, encoding, written, count))
+    assert errors == []
+
+    # Unused trailing frames are trimmed
+    assert bytes(records[0].payload) == payload
+    np.testing.assert_array_equal(decode_payload(records[0].payload, encoding, count), SAMPLES)
+
+
+@pytest.mark.parametrize('swap, encode, swaps', [
+    (steim.swap_steim1, steim.encode_steim1, steim.STEIM1_SWAPS),
+    (steim.swap_steim2, steim.encode_steim2, steim.STEIM2_SWAPS),
+])
+def test_swap_steim(swap, encode, swaps):
+    # Differences of every width, so that each nibble is swapped
+    samples = np.cumsum(np.tile([1, -100, 30000, -7, 2**20, -2**20, 5], 60)).astype(np.int32)
+    payload, count = encode(samples)
+    little_endian = little_endian_steim(payload, swaps)
+    assert little_endian != payload
+    assert swap(little_endian) == payload
+
+    # Control words and integration constants are whole words
+    frames = np.frombuffer(little_endian, dtype='<u4').reshape(-1, steim.FRAME_WORDS)
+    expected = np.frombuffer(payload, dtype='>u4').reshape(-1, steim.FRAME_WORDS)
+    np.testing.assert_array_equal(frames[:, 0], expected[:, 0])
+    np.testing.assert_array_equal(frames[0, 1:3], expected[0, 1:3])
+
+
+def test_microsecond_offset():
+    records, _ = convert(ms2_record('>', 3, SAMPLES.astype('>i4').tobytes(), 10, microsecond=-7),
+                         ms2_record('<', 3, SAMPLES.astype('<i4').tobytes(), 10, microsecond=55))
+    assert [record.nanosecond for record in records] == [123393000, 123455000]
+    assert [record.second for record in records] == [38, 38]
+
+
+@pytest.mark.parametrize('activity, nanosecond', [(0, 623400000), (0x02, 123400000)])
+def test_time_correction(activity, nanosecond):
+    records, _ = convert(ms2_record('>', 3, SAMPLES.astype('>i4').tobytes(), 10,
+                                    correction=5000, activity=activity))
+    record = records[0]
+    assert (record.second, record.nanosecond) == (38, nanosecond)
+    assert extra_headers(record)['FDSN']['Time']['Correction'] == 0.5
+
+
+@pytest.mark.parametrize('order', '<>')
+def test_legacy_encodings(order):
+    # 24-bit integers are re-encoded as Steim-2
+    words = SAMPLES.astype(order + 'i4').view(np.uint8).reshape(-1, 4)
+    int24 = (words[:, :3] if order == '<' else words[:, 1:]).tobytes()
+
+    # GEOSCOPE gain ranged values become 32-bit floats, a mantissa of
+    # 2048 + 6 with an exponent of 3 is 0.75
+    geoscope = np.full(4, 0x3806, dtype=order + 'u2').tobytes()
+
+    records, (_, _, errors, _) = convert(ms2_record(order, 2, int24, len(SAMPLES)),
+                                         ms2_record(order, 13, geoscope, 4))
+    assert errors == []
+    assert [record.encoding for record in records] == [11, 4]
+    np.testing.assert_array_equal(
+        decode_payload(records[0].payload, 11, len(SAMPLES)), SAMPLES)
+    np.testing.assert_array_equal(decode_payload(records[1].payload, 4, 4), [0.75] * 4)
+
+
+def test_calibration_and_unmapped_blockettes():
+    begin = BTIME.pack(2022, 156, 20, 32, 39, 1200)
+    step = (300, begin + struct.pack('>BBLLf3sxL12s12s', 12, 0x05, 6034560, 5000000, 1345.0,
+                                     b'CAL', 45, b'RESISTIVE', b'3dB@10Hz'))
+    abort = (395, begin + bytes(2))
+    beam = (400, struct.pack('>ffHH', 1, 2, 3, 0))
+
+    records, (count, _, errors, dropped) = convert(
+        ms2_record('>', 3, SAMPLES.astype('>i4').tobytes(), 10, [step, abort, beam]))
+    assert (count, errors) == (1, [])
+    assert dropped == {395: 1, 400: 1}
+
+    sequence = extra_headers(records[0])['FDSN']['Calibration']['Sequence']
+    assert len(sequence) == 1
+    assert sequence[0]['Type'] == 'STEP'
+    assert sequence[0]['BeginTime'] == '2022-06-05T20:32:39.120000000Z'
+    assert sequence[0]['Steps'] == 12
+    assert sequence[0]['Trigger'] == 'AUTOMATIC'
@@ -0,0 +1,155 @@
+#
+# Tests of the memory-mapped reader and its sidecar index.
+
+import os
+import random
+
+import pytest
+
+from ms3record import MS3Record, write_records, nstime_to_fields, sample_interval_ns
+from ms3reader import (MS3File, MS3Index, INDEX_HEADER, INDEX_ENTRY, INDEX_SUFFIX,
+                       build_index, load_index, entry_duration)
+
+START = 1654460000 * 10**9
+IDENTIFIERS = ('FDSN:XX_A__B_H_Z', 'FDSN:XX_A__B_H_N', 'FDSN:XX_B__L_H_Z')
+
+
+# Return records of several channels with records of varying length
+# and start times, interleaved as a telemetry stream would be
+def make_records(seed=0):
+    rng = random.Random(seed)
+    records = []
+    for identifier, rate in zip(IDENTIFIERS, (20.0, 20.0, -10.0)):
+        nstime = START + rng.randrange(10**9)
+        for _ in range(40):
+            count = rng.choice((1, 5, 50, 400))
+            records.append(MS3Record(identifier, *nstime_to_fields(nstime),
+                                     encoding=3, sample_rate_period=rate,
+                                     number_samples=count,
+                                     payload=bytes(4 * count)))
+            nstime += sample_interval_ns(rate, count) + rng.choice((0, 0, 10**9, 10**11))
+    rng.shuffle(records)
+    return records
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / 'archive.mseed3')
+    with open(path, 'wb') as fp:
+        write_records(fp, make_records())
+    return path
+
+
+# (offset, identifier, start time, rate, samples) of all records from a
+# full scan of the file
+def scan(path):
+    with MS3File(path) as ms3file:
+        return sorted((record.offset, record.identifier, record.start_time,
+                       record.sample_rate_period, record.number_samples)
+                      for record in ms3file)
+
+
+def entries(index):
+    return sorted(tuple(entry) for entry in index.select())
+
+
+def test_index_matches_scan(archive):
+    index = load_index(archive)
+    assert os.path.exists(archive + INDEX_SUFFIX)
+    assert entries(index) == scan(archive)
+    assert entries(MS3Index.load(archive + INDEX_SUFFIX)) == scan(archive)
+
+
+def test_current_index_is_reused(archive):
+    load_index(archive)
+    before = os.stat(archive + INDEX_SUFFIX).st_mtime_ns
+    assert entries(load_index(archive)) == scan(archive)
+    assert os.stat(archive + INDEX_SUFFIX).st_mtime_ns == before
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:INDEX_HEADER.size - 3],
+    lambda data: data[:-1],
+    lambda data: data + bytes(INDEX_ENTRY.size),
+    lambda data: b'',
+    lambda data: bytes(random.Random(1).randrange(256) for _ in range(len(data))),
+    lambda data: data[:INDEX_HEADER.size - 12] + b'\xff' * 12 + data[INDEX_HEADER.size:],
+])
+def test_corrupt_index_is_rebuilt(archive, corrupt):
+    index_path = archive + INDEX_SUFFIX
+    load_index(archive)
+    with open(index_path, 'rb') as fp:
+        data = fp.read()
+    with open(index_path, 'wb') as fp:
+        fp.write(corrupt(data))
+
+    assert entries(load_index(archive)) == scan(archive)
+    assert entries(MS3Index.load(index_path)) == scan(archive)
+    assert [name for name in os.listdir(os.path.dirname(archive))
+            if name.endswith('.tmp')] == []
+
+
+def test_stale_index_is_rebuilt(archive):
+    index_path = archive + INDEX_SUFFIX
+    load_index(archive)
+
+    # Appended records change the size
+    with open(archive, 'ab') as fp:
+        write_records(fp, make_records(seed=1)[:5])
+    assert entries(load_index(archive)) == scan(archive)
+
+    # A rewrite of the same size only changes the modification time
+    with open(archive, 'rb') as fp:
+        data = bytearray(fp.read())
+    with MS3File(archive) as ms3file:
+        offset = next(iter(ms3file)).offset
+    data[offset + 8:offset + 10] = (2021).to_bytes(2, 'little')  # Year
+    stat = os.stat(archive)
+    with open(archive, 'wb') as fp:
+        fp.write(data)
+    os.utime(archive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    index = load_index(archive)
+    assert index.file_mtime == os.stat(archive).st_mtime_ns
+    assert entries(index) == scan(archive)
+    assert MS3Index.load(index_path).file_mtime == index.file_mtime
+
+
+# Selection by bisection must return exactly the records overlapping a
+# window, including long records that start well before it
+def test_select_windows(archive):
+    index = build_index(archive)
+    records = scan(archive)
+    end = max(start + sample_interval_ns(rate, count - 1)
+              for _, _, start, rate, count in records)
+    rng = random.Random(3)
+
+    windows = [(None, None), (START, None), (None, START + 10**11)]
+    for _ in range(300):
+        first = rng.randrange(START - 10**10, end + 10**10)
+        windows.append((first, first + rng.choice((0, 10**6, 10**9, 10**11))))
+    # Windows touching record boundaries exactly
+    for _, _, start, rate, count in records[:40]:
+        last = start + sample_interval_ns(rate, count - 1)
+        windows += [(last, last + 1), (start - 1, start), (last + 1, None)]
+
+    for pattern in (None, IDENTIFIERS[0], 'FDSN:XX_A__*'):
+        for starttime, endtime in windows:
+            expected = [record[0] for record in records
+                        if (pattern is None or record[1] in index.identifiers(pattern)) and
+                        (endtime is None or record[2] <= endtime) and
+                        (starttime is None or
+                         record[2] + sample_interval_ns(record[3], record[4] - 1) >= starttime)]
+            selected = index.select(pattern, starttime, endtime)
+            assert [entry.offset for entry in selected] == expected
+
+
+def test_select_records(archive):
+    index = load_index(archive)
+    selected = index.select(IDENTIFIERS[2], START + 10**11)
+    assert selected
+    with MS3File(archive) as ms3file:
+        for entry, record in zip(selected, ms3file.records(selected)):
+            assert record.identifier == entry.identifier
+            assert record.start_time == entry.start_time
+            assert record.start_time + entry_duration(entry) >= START + 10**11
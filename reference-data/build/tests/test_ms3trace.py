@@ -0,0 +1,79 @@
+#
+# Tests of trace assembly and publication version resolution.
+
+import numpy as np
+import pytest
+
+from ms3pack import pack_samples
+from ms3record import pack_records, sample_interval_ns
+from ms3trace import RecordTable, Segment, assemble_table, resolve_versions
+
+IDENTIFIER = 'FDSN:XX_A__B_H_Z'
+START = 1600000000123456789
+
+rng = np.random.default_rng(3)
+SAMPLES = np.cumsum(rng.integers(-50, 50, 20000)).astype(np.int32)
+
+
+# Return records of SAMPLES[first:last] at their times from START
+def make_records(rate, first, last, pub_version=1, **kwargs):
+    return list(pack_samples(IDENTIFIER, START + sample_interval_ns(rate, first), rate,
+                             SAMPLES[first:last], 512, pub_version=pub_version, **kwargs))
+
+
+# Return (publication version, number of samples) of each segment
+def summary(segments):
+    return [(segment.pub_version, len(segment.samples)) for segment in segments]
+
+
+# A higher version covering samples 2000 to 7000 of a lower version
+# leaves the lower version samples either side of it.  The time
+# following the last covering sample is rounded up by a nanosecond at 3
+# Hz, which must not drop the next sample.
+@pytest.mark.parametrize('rate', (3.0, 100.0, -10.0))
+@pytest.mark.parametrize('shift', (0, -1, 1))
+def test_resolve_versions_edges(rate, shift):
+    lower = Segment(IDENTIFIER, 1, 0, rate, np.arange(9000))
+    higher = Segment(IDENTIFIER, 2, sample_interval_ns(rate, 2000) + shift, rate, np.arange(5000))
+
+    resolved = resolve_versions([lower, higher])
+    assert summary(resolved) == [(1, 2000), (2, 5000), (1, 2000)]
+    assert resolved[2].samples[0] == 7000
+    assert resolved[2].start_time == sample_interval_ns(rate, 7000)
+
+
+# Covering spans more than half a sample period from the sample times
+# cover the sample before or leave the first sample uncovered
+@pytest.mark.parametrize('direction, expected', [
+    (-1, [(1, 1999), (2, 5000), (1, 2001)]),
+    (1, [(1, 2001), (2, 5000), (1, 1999)]),
+])
+def test_resolve_versions_beyond_half_interval(direction, expected):
+    shift = direction * (sample_interval_ns(100.0) // 2 + 1)
+    lower = Segment(IDENTIFIER, 1, 0, 100.0, np.arange(9000))
+    higher = Segment(IDENTIFIER, 2, sample_interval_ns(100.0, 2000) + shift, 100.0,
+                     np.arange(5000))
+    assert summary(resolve_versions([lower, higher])) == expected
+
+
+@pytest.mark.parametrize('rate', (100.0, -10.0, 3.0))
+def test_assemble_table(rate):
+    records = (make_records(rate, 0, 5000) +
+               make_records(rate, 5000, 9000, encodings=[3]) +
+               make_records(rate, 9500, 12000) +
+               make_records(rate, 11800, 15000) +
+               make_records(rate, 2000, 7000, pub_version=2))
+    rng.shuffle(records)
+
+    segments, discontinuities = assemble_table(RecordTable.from_buffer(pack_records(records)))
+    interval = sample_interval_ns(rate)
+    assert [(gap.pub_version, round(gap.duration / interval)) for gap in discontinuities] == \
+        [(1, 500), (1, -200)]
+
+    resolved = resolve_versions(segments)
+    assert summary(resolved) == [(1, 2000), (2, 5000), (1, 2000), (1, 2500), (1, 3200)]
+    for segment in resolved:
+        first = round((segment.start_time - START) * rate / 1e9 if rate > 0 else
+                      (segment.start_time - START) / (-rate * 1e9))
+        np.testing.assert_array_equal(segment.samples,
+                                      SAMPLES[first:first + len(segment.samples)])
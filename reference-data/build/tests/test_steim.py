@@ -0,0 +1,193 @@
+#
+# Tests of the Steim-1 and Steim-2 encoder and decoder.
+
+import base64
+import json
+import os
+
+import numpy as np
+import pytest
+
+import generate_miniseed3
+from steim import (STEIM1_CLASSES, STEIM2_CLASSES, FRAME_LENGTH, DECODE_CHUNK_FRAMES,
+                   decode_steim1, decode_steim2, decode_steim1_many, decode_steim2_many,
+                   encode_steim1, encode_steim2)
+
+REFERENCE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+CODECS = {
+    'steim1': (encode_steim1, decode_steim1, STEIM1_CLASSES),
+    'steim2': (encode_steim2, decode_steim2, STEIM2_CLASSES),
+}
+DECODE_MANY = {'steim1': decode_steim1_many, 'steim2': decode_steim2_many}
+
+
+# Return the samples of a reference JSON file
+def reference_samples(name):
+    with open(os.path.join(REFERENCE_DIRECTORY, f'reference-{name}.json')) as fp:
+        return np.array(json.load(fp)[0]['Data'], dtype=np.int32)
+
+
+# Return random samples whose differences are drawn around each of the
+# class widths, including the largest and smallest difference of each
+def boundary_samples(classes, length, seed):
+    rng = np.random.default_rng(seed)
+    limits = sorted({1 << (width - 1) for _, _, _, width in classes})
+    edges = [value for limit in limits for value in (limit - 1, -limit, limit, -limit - 1)]
+    choices = np.array([0, 1, -1] + edges[:-2], dtype=np.int64)
+
+    # Runs of one difference class so that every word count is used
+    differences = np.repeat(rng.choice(choices, length // 8 + 1), 8)[:length]
+    noise = rng.integers(-3, 4, length)
+    differences = np.where(np.abs(differences) > 4, differences, noise)
+    samples = np.cumsum(differences) + rng.integers(-2**20, 2**20)
+    return np.clip(samples, -2**31, 2**31 - 1).astype(np.int32)
+
+
+@pytest.mark.parametrize('name, count', [('steim1', 500), ('steim2', 499)])
+def test_reference_payloads(name, count):
+    encode, decode, _ = CODECS[name]
+    payload = base64.b64decode(getattr(generate_miniseed3, f'data_{name}_{count}'))
+    expected = reference_samples(f'sinusoid-{name}')
+    assert len(expected) == count
+
+    samples = decode(payload, count)
+    assert samples.dtype == np.int32
+    np.testing.assert_array_equal(samples, expected)
+
+    out = np.empty(count, dtype=np.int32)
+    assert decode(payload, count, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+
+    # The encoder chooses the same words as the reference encoder
+    assert encode(expected) == (payload, count)
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+@pytest.mark.parametrize('seed', range(20))
+def test_round_trip(name, seed):
+    encode, decode, classes = CODECS[name]
+    rng = np.random.default_rng(seed)
+    length = int(rng.choice((1, 2, 7, 13, 100, 1000, 5000)))
+    samples = boundary_samples(classes, length, seed)
+
+    payload, count = encode(samples)
+    assert count == length
+    assert len(payload) % FRAME_LENGTH == 0
+    np.testing.assert_array_equal(decode(payload, count), samples)
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+@pytest.mark.parametrize('max_frames', (1, 2, 7))
+def test_max_frames(name, max_frames):
+    encode, decode, classes = CODECS[name]
+    samples = boundary_samples(classes, 5000, max_frames)
+
+    payload, count = encode(samples, max_frames=max_frames)
+    assert len(payload) == max_frames * FRAME_LENGTH
+    assert 0 < count < len(samples)
+    np.testing.assert_array_equal(decode(payload, count), samples[:count])
+
+    # No more samples fit, the next record starts where this one stopped
+    assert encode(samples[:count + 1], max_frames=max_frames)[1] == count
+
+    # A record needing fewer frames is not padded
+    payload, count = encode(samples[:3], max_frames=max_frames)
+    assert len(payload) == FRAME_LENGTH and count == 3
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_payload_over_many_chunks(name):
+    encode, decode, classes = CODECS[name]
+    samples = boundary_samples(classes, 400000, 1)
+    payload, count = encode(samples)
+    assert len(payload) > 2 * DECODE_CHUNK_FRAMES * FRAME_LENGTH
+    np.testing.assert_array_equal(decode(payload, count), samples)
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_decode_many(name):
+    encode, decode, classes = CODECS[name]
+    samples = boundary_samples(classes, 3000, 2)
+
+    # Records of varying frame counts, including an empty one, each
+    # with its own integration constants
+    payloads = []
+    counts = []
+    position = 0
+    for max_frames in (1, 3, 2, 7, 1, 4):
+        payload, count = encode(samples[position:], max_frames=max_frames)
+        payloads.append(payload)
+        counts.append(count)
+        position += count
+    payloads.insert(2, b'')
+    counts.insert(2, 0)
+
+    decoded = DECODE_MANY[name](payloads, counts)
+    np.testing.assert_array_equal(decoded, samples[:position])
+    out = np.empty(position, dtype=np.int32)
+    assert DECODE_MANY[name](payloads, counts, out=out) is out
+    np.testing.assert_array_equal(out, samples[:position])
+
+    # Errors name the payload
+    with pytest.raises(ValueError, match='payload 1 contains'):
+        DECODE_MANY[name](payloads, [counts[0], counts[1] + 1000] + counts[2:])
+    corrupt = bytearray(payloads[3])
+    corrupt[11] ^= 1
+    with pytest.raises(ValueError, match='reverse integration constant'):
+        DECODE_MANY[name](payloads[:3] + [bytes(corrupt)] + payloads[4:], counts)
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_extreme_differences(name):
+    encode, decode, _ = CODECS[name]
+    samples = np.array([0, 2**31 - 1, -2**31, 2**31 - 1, 0, -1, 0], dtype=np.int64)
+    if name == 'steim2':
+        # Steim-2 differences are limited to 30 bits
+        with pytest.raises(ValueError, match='too large'):
+            encode(samples)
+        samples = np.array([0, 2**29 - 1, 0, -2**29, -1], dtype=np.int64)
+
+    payload, count = encode(samples)
+    assert count == len(samples)
+    np.testing.assert_array_equal(decode(payload, count), samples)
+
+
+def test_diff0():
+    samples = np.arange(100, 200, dtype=np.int32)
+    payload, count = encode_steim2(samples, diff0=5)
+    np.testing.assert_array_equal(decode_steim2(payload, count), samples)
+    assert encode_steim2(samples, diff0=0)[0] != payload
+
+
+def test_encode_errors():
+    with pytest.raises(ValueError, match='one dimensional'):
+        encode_steim1(np.zeros((2, 2), dtype=np.int32))
+    with pytest.raises(ValueError, match='32-bit'):
+        encode_steim1(np.array([0, 2**31]))
+    assert encode_steim1(np.zeros(0, dtype=np.int32)) == (b'', 0)
+
+
+def test_decode_errors():
+    payload, count = encode_steim2(np.arange(50, dtype=np.int32) ** 2)
+
+    with pytest.raises(ValueError, match='no frames'):
+        decode_steim2(payload[:FRAME_LENGTH - 1], count)
+    with pytest.raises(ValueError, match='expected'):
+        decode_steim2(payload, count + 1000)
+
+    # Reverse integration constant
+    corrupt = bytearray(payload)
+    corrupt[11] ^= 1
+    with pytest.raises(ValueError, match='reverse integration constant'):
+        decode_steim2(bytes(corrupt), count)
+    assert len(decode_steim2(bytes(corrupt), count, check=False)) == count
+
+    # A Steim-2 nibble of 3 with a dnib of 3 is not a valid data word
+    corrupt = bytearray(payload)
+    corrupt[0] |= 0x03
+    corrupt[12] |= 0xC0
+    with pytest.raises(ValueError, match='Invalid Steim data word'):
+        decode_steim2(bytes(corrupt), count)
+
+    assert len(decode_steim1(b'', 0)) == 0
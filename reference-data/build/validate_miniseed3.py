@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+# Validate miniSEED V3 files against the fixed header rules in
+# definition.rst and the FDSN extra headers JSON Schema.
+#
+# Files are validated in parallel by a pool of worker processes, each
+# of which compiles the schema validator once.
+
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import collections
+import concurrent.futures
+
+import jsonschema
+
+from ms3reader import MS3File, RecordView, frame_record, find_files
+from ms3record import (FORMAT_VERSION, VALID_ENCODINGS, SAMPLE_SIZES,
+                       STEIM_ENCODINGS, STEIM_FRAME_LENGTH)
+
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', '..', 'extra-headers',
+                              'ExtraHeaders-FDSN-v1.0.schema-2023-07.json')
+
+FileReport = collections.namedtuple('FileReport', [
+    'path',
+    'records',
+    'bytes',
+    'errors',  # List of (offset, message)
+])
+
+
+# Return a compiled validator for a schema file, cached so each worker
+# process loads and compiles it only once.  The 2023-07 dialect is the
+# 2020-12 vocabulary under a newer identifier.  Formats such as the
+# date-time of event and timing exception times are checked, date-time
+# only when jsonschema's format dependencies (rfc3339-validator) are
+# installed.
+@functools.lru_cache(maxsize=None)
+def load_validator(schema_path):
+    with open(schema_path) as fp:
+        schema = json.load(fp)
+    return jsonschema.Draft202012Validator(
+        schema, format_checker=jsonschema.Draft202012Validator.FORMAT_CHECKER)
+
+
+# Return a list of problems with the fixed header and lengths of a record
+def check_header(record):
+    errors = []
+
+    if record.format_version != FORMAT_VERSION:
+        errors.append(f'Format version is {record.format_version}, expected {FORMAT_VERSION}')
+
+    if not (record.nanosecond <= 999999999 and 1 <= record.day <= 366 and
+            record.hour <= 23 and record.minute <= 59 and record.second <= 60):
+        errors.append('Start time fields out of range')
+
+    encoding = record.encoding
+    number_samples = record.number_samples
+    length_payload = record.length_payload
+
+    if encoding not in VALID_ENCODINGS:
+        errors.append(f'Invalid data payload encoding {encoding}')
+    elif encoding in SAMPLE_SIZES:
+        if number_samples * SAMPLE_SIZES[encoding] != length_payload:
+            errors.append(f'Payload length {length_payload} does not match '
+                          f'{number_samples} samples of encoding {encoding}')
+    elif encoding in STEIM_ENCODINGS:
+        if length_payload % STEIM_FRAME_LENGTH:
+            errors.append(f'Steim payload length {length_payload} is not a '
+                          f'multiple of {STEIM_FRAME_LENGTH}')
+
+    if number_samples and not length_payload:
+        errors.append(f'Number of samples is {number_samples} with no payload')
+
+    if record.length_identifier == 0:
+        errors.append('Source identifier is empty')
+    else:
+        try:
+            record.identifier
+        except UnicodeDecodeError:
+            errors.append('Source identifier is not ASCII')
+
+    if not record.crc_valid:
+        errors.append(f'CRC mismatch, header value 0x{record.crc:08X}')
+
+    return errors
+
+
+# Return a list of problems with the extra headers of a record, which
+# are only decoded when present
+def check_extra_header(record, validator):
+    if not record.length_extra_header:
+        return []
+
+    try:
+        extra_header = record.extra_headers
+    except ValueError as error:
+        return [f'Extra headers are not valid JSON: {error}']
+
+    if not isinstance(extra_header, dict):
+        return ['Extra headers are not a JSON object']
+
+    return [f'Extra header /{"/".join(str(p) for p in error.absolute_path)}: '
+            f'{error.message}'
+            for error in validator.iter_errors(extra_header)]
+
+
+# Validate all records in a buffer, return (records, errors).  Framing
+# errors stop validation as later record boundaries cannot be found.
+def validate_buffer(buffer, validator):
+    buffer = memoryview(buffer)
+    end = len(buffer)
+    errors = []
+    records = 0
+    offset = 0
+
+    while offset < end:
+        try:
+            length = frame_record(buffer, offset, end)
+        except ValueError as error:
+            errors.append((offset, str(error)))
+            break
+
+        record = RecordView(buffer, offset)
+        for message in (check_header(record) +
+                        check_extra_header(record, validator)):
+            errors.append((offset, message))
+
+        records += 1
+        offset += length
+
+    return records, errors
+
+
+# Validate a single file, return a FileReport
+def validate_file(path, schema_path=DEFAULT_SCHEMA):
+    validator = load_validator(schema_path)
+    try:
+        with MS3File(path) as ms3file:
+            records, errors = validate_buffer(ms3file.buffer, validator)
+            length = len(ms3file)
+    except OSError as error:
+        return FileReport(path, 0, 0, [(0, str(error))])
+    return FileReport(path, records, length, errors)
+
+
+# Validate files in parallel, yielding a FileReport for each in order
+def validate_files(paths, schema_path=DEFAULT_SCHEMA, workers=None):
+    paths = list(paths)
+    if workers == 1:
+        for path in paths:
+            yield validate_file(path, schema_path)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(functools.partial(validate_file, schema_path=schema_path),
+                                paths, chunksize=chunksize)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Validate miniSEED V3 files.')
+
+    parser.add_argument('paths', nargs='+',
+                        help='Files or directories to validate')
+    parser.add_argument('-x', '--schema', dest='schema', default=DEFAULT_SCHEMA,
+                        help='Extra headers JSON Schema (default FDSN 2023-07 schema)')
+    parser.add_argument('-p', '--pattern', dest='pattern', default='*.mseed3',
+                        help='File name pattern in directories (default "*.mseed3")')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Number of worker processes (default is number of CPUs)')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
+                        help='Only print the summary')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    files = records = length = errors = 0
+
+    for report in validate_files(find_files(args.paths, args.pattern),
+                                 args.schema, args.jobs):
+        files += 1
+        records += report.records
+        length += report.bytes
+        errors += len(report.errors)
+        if not args.quiet:
+            for offset, message in report.errors:
+                print(f'{report.path} {offset}: {message}')
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{files} files, {records} records, {length} bytes, {errors} errors '
+          f'in {elapsed:.2f} s ({records / elapsed:.0f} records/s, '
+          f'{length / elapsed / 1e6:.1f} MB/s)', file=sys.stderr)
+
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()